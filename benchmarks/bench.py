@@ -0,0 +1,389 @@
+"""
+Benchmark suite for the /products and /sales endpoints.
+
+Seeds synthetic catalogs in a temporary SQLite db, drives the endpoints through AppFactory's test client
+and the service classes directly, and reports throughput, p50/p99 latency, SQL queries per operation and
+peak Python memory for each scenario. Everything runs locally, with no external services: the concurrent
+checkouts run in worker processes, each with its own app on the same db file, and the other scenarios
+in-process.
+
+Usage:
+    python benchmarks/bench.py                                   # 1k and 100k catalogs
+    python benchmarks/bench.py --sizes 1k,100k,1m --output results.json
+    python benchmarks/bench.py --compare baseline.json           # exits with status 1 on regressions
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+from multiprocessing.util import Finalize  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+from server import AppFactory  # noqa: E402
+from db import Product  # noqa: E402
+
+CATALOG_SIZES = {"1k": 1_000, "100k": 100_000, "1m": 1_000_000}
+CART_SIZES = (1, 10, 100, 1000)
+# Worker processes of the concurrent checkout scenarios, and the checkouts each timed run spreads across them
+CHECKOUT_WORKERS = (1, 2, 4, 8)
+CHECKOUT_ROUND = 32
+# Rows inserted per executemany batch when seeding a catalog
+SEED_CHUNK_SIZE = 50_000
+
+
+class QueryCounter:
+    """
+    Counts the SQL statements executed on an engine by the benchmark thread, through its before_cursor_execute
+    event. Statements of background threads, such as the sales ledger writer, are not counted.
+    """
+
+    def __init__(self, engine):
+        self.count = 0
+        self.thread_id = threading.get_ident()
+        event.listen(engine, "before_cursor_execute", self.on_execute)
+
+    def on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == self.thread_id:
+            self.count += 1
+
+
+def seed_catalog(factory: AppFactory, size: int, seed: int = 42) -> None:
+    """
+    Replace the catalog with 'size' synthetic products, inserted in SEED_CHUNK_SIZE executemany batches,
+    and rebuild the catalog snapshot.
+    """
+    rng = random.Random(seed)
+    service = factory.app.products_service
+    with factory.app.app_context():
+        session = factory.db.session
+        session.execute(factory.db.delete(Product))
+        for start in range(0, size, SEED_CHUNK_SIZE):
+            rows = [
+                {"name": f"Product {i}", "price_cents": rng.randint(100, 50000)}
+                for i in range(start, min(start + SEED_CHUNK_SIZE, size))
+            ]
+            session.execute(factory.db.insert(Product), rows)
+        service.bump_catalog_version()
+        session.commit()
+        service.refresh_snapshot(rebuild=True)
+
+
+def sale_payload(catalog_size: int, cart_size: int, rng: random.Random) -> dict:
+    """
+    Build a sale of 'cart_size' line items over random products of the seeded catalog.
+    """
+    return {
+        "line_items": [{"id": rng.randint(1, catalog_size), "quantity": rng.randint(1, 5)} for _ in range(cart_size)],
+        "discount": rng.randint(0, 50),
+    }
+
+
+def measure(operation, counter: QueryCounter, iterations: int, max_seconds: float, warmup: int = 1) -> dict:
+    """
+    Time 'operation' for up to 'iterations' runs, stopping early once 'max_seconds' are spent (after at least
+    3 runs), then run it once more under tracemalloc to record its peak memory.
+    """
+    for _ in range(warmup):
+        operation()
+    latencies = []
+    queries_before = counter.count
+    started = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        operation()
+        latencies.append(time.perf_counter() - t0)
+        if len(latencies) >= 3 and time.perf_counter() - started > max_seconds:
+            break
+    elapsed = time.perf_counter() - started
+    queries = counter.count - queries_before
+
+    tracemalloc.start()
+    operation()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        "iterations": len(latencies),
+        "throughput_ops": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(statistics.median(latencies) * 1000, 3),
+        "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 3),
+        "queries_per_op": round(queries / len(latencies), 2),
+        "peak_memory_kb": round(peak / 1024, 1),
+    }
+
+
+def expect(response, status: int):
+    """
+    Fail the benchmark if an endpoint did not answer with the expected status.
+    """
+    if response.status_code != status:
+        raise RuntimeError(f"Expected HTTP {status}, got {response.status_code}: {response.get_data(as_text=True)[:200]}")
+    return response
+
+
+def run_catalog(size_name: str, iterations: int, max_seconds: float) -> list[dict]:
+    """
+    Run every scenario against a freshly seeded catalog of the given size.
+    """
+    size = CATALOG_SIZES[size_name]
+    results = []
+    with tempfile.TemporaryDirectory() as basedir:
+        factory = AppFactory(basedir)
+        app = factory.app
+        client = app.test_client()
+        products_service = app.products_service
+        sales_service = app.sales_service
+        seed_catalog(factory, size)
+        with app.app_context():
+            counter = QueryCounter(factory.db.engine)
+
+        def record(name, operation, **params):
+            result = measure(operation, counter, iterations, max_seconds)
+            results.append({"name": name, "catalog_size": size_name, **params, **result})
+            print(format_result(results[-1]), flush=True)
+
+        def list_uncached():
+            products_service.rendered_catalog = None
+            expect(client.get("/products"), 200)
+
+        def without_snapshot(operation):
+            def run():
+                products_service.catalog_snapshot = sales_service.catalog_snapshot = None
+                try:
+                    operation()
+                finally:
+                    products_service.catalog_snapshot = sales_service.catalog_snapshot = app.catalog_snapshot
+            return run
+
+        record("GET /products", list_uncached)
+        record("GET /products (db)", without_snapshot(list_uncached))
+        record("GET /products (cached)", lambda: expect(client.get("/products"), 200))
+        etag = client.get("/products").headers["ETag"]
+        record("GET /products (304)", lambda: expect(client.get("/products", headers={"If-None-Match": etag}), 304))
+        record("GET /products?limit=1000", lambda: expect(client.get(f"/products?after_id={size // 2}&limit=1000"), 200))
+        record("GET /products?limit=1000 (db)",
+               without_snapshot(lambda: expect(client.get(f"/products?after_id={size // 2}&limit=1000"), 200)))
+        record("GET /products?stream=ndjson", lambda: expect(client.get("/products?stream=ndjson"), 200).get_data())
+        record("GET /products?name=", lambda: expect(client.get("/products?name=Product 4242&limit=20"), 200))
+        record("GET /products?q=", lambda: expect(client.get("/products?q=4242&limit=20"), 200))
+        record("GET /products?max_price=&sort=price",
+               lambda: expect(client.get("/products?min_price=100&max_price=105&sort=price&limit=20"), 200))
+
+        def list_service():
+            products_service.rendered_catalog = None
+            with app.test_request_context("/products"):
+                products_service.list_products()
+
+        record("ProductService.list_products", list_service)
+        record("POST /products", lambda: expect(client.post("/products", json={"name": "Bench Product", "price": 9.99}), 201))
+
+        rng = random.Random(7)
+        for cart_size in CART_SIZES:
+            payloads = [sale_payload(size, cart_size, rng) for _ in range(16)]
+            cycle = iter(payloads * (iterations // len(payloads) + 4))
+            record("POST /sales", lambda: expect(client.post("/sales", json=next(cycle)), 200), line_items=cart_size)
+
+            def sale_service():
+                with app.test_request_context("/sales"):
+                    sales_service.process_sale(next(cycle))
+
+            cycle = iter(payloads * (iterations // len(payloads) + 4))
+            record("SalesService.process_sale", sale_service, line_items=cart_size)
+            cycle = iter(payloads * (iterations // len(payloads) + 4))
+            record("POST /sales (db)", without_snapshot(lambda: expect(client.post("/sales", json=next(cycle)), 200)),
+                   line_items=cart_size)
+
+        for workers in CHECKOUT_WORKERS:
+            record_checkouts(factory, basedir, workers, record)
+        scaling = checkout_scaling(results)
+        for result in results:
+            if result["name"] == "POST /sales (concurrent checkouts)":
+                result["speedup"] = scaling[result["workers"]]
+        print("Checkout throughput vs 1 process: " + ", ".join(f"{w} -> x{x}" for w, x in scaling.items()), flush=True)
+
+        app.sales_ledger.close()
+        with app.app_context():
+            factory.db.engine.dispose()
+    return results
+
+
+def set_stock(factory: AppFactory, product_id: int, stock: int | None) -> None:
+    """
+    Set the stock of a product, publishing whether it is tracked to the catalog snapshot.
+    """
+    with factory.app.app_context():
+        factory.db.session.execute(factory.db.update(Product).where(Product.id == product_id).values(stock=stock))
+        factory.app.products_service.bump_catalog_version()
+        factory.db.session.commit()
+        factory.app.products_service.refresh_snapshot(rebuild=True)
+
+
+def get_stock(factory: AppFactory, product_id: int) -> int | None:
+    with factory.app.app_context():
+        return factory.db.session.get(Product, product_id).stock
+
+
+# App of a checkout worker process, built by start_checkout_worker
+checkout_app = None
+
+
+def start_checkout_worker(basedir: str) -> None:
+    """
+    Build the app of a checkout worker process on the benchmark's db file, like a worker of a multi-process
+    server. Its sales ledger is closed, writing the queued sales, when the pool stops the process.
+    """
+    global checkout_app
+    checkout_app = AppFactory(basedir).app
+    Finalize(checkout_app, checkout_app.sales_ledger.close, exitpriority=10)
+
+
+def checkout(sale: dict) -> int:
+    return checkout_app.test_client().post("/sales", json=sale).status_code
+
+
+def record_checkouts(factory: AppFactory, basedir: str, workers: int, record) -> None:
+    """
+    Time rounds of CHECKOUT_ROUND concurrent checkouts of one stock-tracked product across 'workers' processes,
+    the worst case for the stock reservation, then check nothing was oversold: the stock sold must match the
+    successful checkouts, and selling out a small stock must accept exactly that many checkouts.
+
+    The processes are spawned rather than forked, so they start clean of the benchmark's app and threads.
+    """
+    sale = {"line_items": [{"id": 1, "quantity": 1}], "discount": 0}
+    set_stock(factory, 1, 10_000_000)
+    sold = [0]
+    pool = multiprocessing.get_context("spawn").Pool(workers, start_checkout_worker, (basedir,))
+    try:
+        # Warms every worker up before the timed rounds, so none of them pays its app's startup in a round
+        sold[0] += pool.map(checkout, [sale] * workers * 4, chunksize=1).count(200)
+
+        def checkout_round():
+            statuses = pool.map(checkout, [sale] * CHECKOUT_ROUND, chunksize=1)
+            if any(status != 200 for status in statuses):
+                raise RuntimeError(f"Expected HTTP 200 for every checkout, got {sorted(set(statuses))}")
+            sold[0] += len(statuses)
+
+        record("POST /sales (concurrent checkouts)", checkout_round, workers=workers, checkouts_per_op=CHECKOUT_ROUND)
+        if 10_000_000 - get_stock(factory, 1) != sold[0]:
+            raise RuntimeError(f"Stock sold does not match the {sold[0]} successful checkouts.")
+        set_stock(factory, 1, 5)
+        accepted = pool.map(checkout, [sale] * CHECKOUT_ROUND, chunksize=1).count(200)
+        if accepted != 5 or get_stock(factory, 1) != 0:
+            raise RuntimeError(f"Oversold: {accepted} checkouts accepted for a stock of 5.")
+    finally:
+        pool.close()
+        pool.join()
+    set_stock(factory, 1, None)
+
+
+def checkout_scaling(results: list[dict]) -> dict[int, float]:
+    """
+    Compute the checkout throughput of each number of worker processes relative to a single one.
+    """
+    throughput = {r["workers"]: r["throughput_ops"] for r in results if r["name"] == "POST /sales (concurrent checkouts)"}
+    return {workers: round(ops / throughput[1], 2) for workers, ops in throughput.items()} if 1 in throughput else {}
+
+
+def result_key(result: dict) -> str:
+    key = f"{result['name']} [catalog={result['catalog_size']}"
+    if "line_items" in result:
+        key += f", line_items={result['line_items']}"
+    if "workers" in result:
+        key += f", workers={result['workers']}"
+    return key + "]"
+
+
+def format_result(result: dict) -> str:
+    return (
+        f"{result_key(result):<64} {result['throughput_ops']:>10.1f} ops/s  p50 {result['p50_ms']:>9.3f} ms  "
+        f"p99 {result['p99_ms']:>9.3f} ms  {result['queries_per_op']:>6.2f} q/op  {result['peak_memory_kb']:>10.1f} KiB"
+    )
+
+
+def compare(results: list[dict], baseline: dict, threshold: float) -> list[str]:
+    """
+    Compare results with a stored baseline run, returning a description of every regression.
+
+    A scenario regresses when its p50 latency grows, or its throughput drops, by more than 'threshold'
+    (a fraction), or when it runs more SQL queries per operation than in the baseline.
+    """
+    previous = {result_key(r): r for r in baseline["results"]}
+    regressions = []
+    for result in results:
+        key = result_key(result)
+        if key not in previous:
+            continue
+        old = previous[key]
+        if result["p50_ms"] > old["p50_ms"] * (1 + threshold):
+            regressions.append(f"{key}: p50 {old['p50_ms']} ms -> {result['p50_ms']} ms")
+        if result["throughput_ops"] < old["throughput_ops"] * (1 - threshold):
+            regressions.append(f"{key}: throughput {old['throughput_ops']} -> {result['throughput_ops']} ops/s")
+        if result["queries_per_op"] > old["queries_per_op"]:
+            regressions.append(f"{key}: queries/op {old['queries_per_op']} -> {result['queries_per_op']}")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the /products and /sales endpoints.")
+    parser.add_argument("--sizes", default="1k,100k", help=f"Comma-separated catalog sizes among {', '.join(CATALOG_SIZES)}.")
+    parser.add_argument("--iterations", type=int, default=200, help="Max timed runs per scenario.")
+    parser.add_argument("--max-seconds", type=float, default=5.0, help="Time budget per scenario, after at least 3 runs.")
+    parser.add_argument("--output", help="Write the results as JSON to this path.")
+    parser.add_argument("--compare", help="Baseline results JSON to compare with; exits with status 1 on regressions.")
+    parser.add_argument("--threshold", type=float, default=0.15, help="Relative slowdown tolerated by --compare.")
+    args = parser.parse_args(argv)
+
+    sizes = [s.strip().lower() for s in args.sizes.split(",") if s.strip()]
+    unknown = [s for s in sizes if s not in CATALOG_SIZES]
+    if unknown:
+        parser.error(f"Unknown catalog sizes: {', '.join(unknown)}.")
+
+    results = []
+    for size_name in sizes:
+        print(f"== catalog of {CATALOG_SIZES[size_name]:,} products", flush=True)
+        results += run_catalog(size_name, args.iterations, args.max_seconds)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "iterations": args.iterations,
+            "max_seconds": args.max_seconds,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) against {args.compare}:")
+            for regression in regressions:
+                print(f"  - {regression}")
+            return 1
+        print(f"\nNo regressions against {args.compare}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,169 @@
+"""
+Response compression negotiated from the request's Accept-Encoding header.
+
+gzip is always available, and zstd and brotli are offered when the zstandard and brotli packages are
+installed. Streamed responses are compressed chunk by chunk, flushing after each one, so clients still
+receive the rows as they are produced.
+"""
+import os
+import threading
+import zlib
+from flask import request, Response
+try:
+    import brotli
+except ImportError:  # brotli is optional, "br" is only offered when it is installed
+    brotli = None
+try:
+    import zstandard
+except ImportError:  # zstandard is optional, "zstd" is only offered when it is installed
+    zstandard = None
+
+# Mimetypes of the responses worth compressing
+COMPRESSIBLE_MIMETYPES = ("application/json", "application/x-ndjson", "text/plain", "text/html", "text/csv")
+# Number of compressed bodies of ETagged responses kept, so an unchanged catalog is only compressed once per encoding
+CACHE_SIZE = 16
+
+class GzipEncoder:
+    def __init__(self):
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 writes the gzip header and trailer
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self.compressor.flush()
+
+class BrotliEncoder:
+    def __init__(self):
+        self.compressor = brotli.Compressor(quality=5)
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.process(data) + self.compressor.flush()
+
+    def finish(self) -> bytes:
+        return self.compressor.finish()
+
+class ZstdEncoder:
+    def __init__(self):
+        self.compressor = zstandard.ZstdCompressor(level=3).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.compress(data) + self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        return self.compressor.flush()
+
+# Available encoders by content-coding, in the server's order of preference when the client accepts several equally
+ENCODERS = {
+    **({"zstd": ZstdEncoder} if zstandard else {}),
+    **({"br": BrotliEncoder} if brotli else {}),
+    "gzip": GzipEncoder,
+}
+
+def load_compression_config(environ=None) -> dict:
+    """
+    Build the compression configuration from the COMPRESSION_* environment variables:
+        - COMPRESSION_ENABLED (default 1): compress responses for clients that accept it.
+        - COMPRESSION_MIN_SIZE (default 1024): smallest body, in bytes, that is compressed. Streamed bodies
+          have no known size and are always compressed.
+        - COMPRESSION_ENCODINGS (default every available one): comma-separated content-codings to offer.
+
+    Args:
+        environ (dict, optional): The environment to read from, defaults to os.environ.
+    Returns:
+        dict: The keyword arguments for Compressor.
+    Raises:
+        ValueError: If the minimum size is not a non-negative integer, or an encoding is not available.
+    """
+    environ = os.environ if environ is None else environ
+    min_size = environ.get("COMPRESSION_MIN_SIZE", "1024")
+    if not min_size.isdigit():
+        raise ValueError("COMPRESSION_MIN_SIZE must be a non-negative integer.")
+    encodings = [e.strip() for e in environ.get("COMPRESSION_ENCODINGS", ",".join(ENCODERS)).split(",") if e.strip()]
+    unknown = [e for e in encodings if e not in ENCODERS]
+    if unknown:
+        raise ValueError(f"COMPRESSION_ENCODINGS must be among: {', '.join(ENCODERS)}.")
+    return {
+        "enabled": environ.get("COMPRESSION_ENABLED", "1") not in ("0", "false", "False"),
+        "min_size": int(min_size),
+        "encodings": encodings,
+    }
+
+class Compressor:
+    """
+    Compresses the app's responses with the best encoding the client accepts, from an after_request hook.
+
+    Compressed responses get a weak ETag, since their bytes differ from the identity representation,
+    and the compressed bodies of ETagged responses are cached, keyed by path, ETag and encoding.
+    """
+
+    def __init__(self, enabled: bool = True, min_size: int = 1024, encodings: list = None):
+        self.enabled = enabled
+        self.min_size = min_size
+        self.encodings = list(ENCODERS) if encodings is None else encodings
+        self.cache = {}
+        self.lock = threading.Lock()
+
+    def init_app(self, app) -> None:
+        """
+        Register the compression hook. Does nothing when compression is disabled.
+        """
+        if not self.enabled or not self.encodings:
+            return
+        app.after_request(self.compress_response)
+
+    def compress_response(self, response: Response) -> Response:
+        if (response.status_code < 200 or response.status_code in (204, 206, 304) or response.direct_passthrough
+                or "Content-Encoding" in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+            return response
+        response.vary.add("Accept-Encoding")
+        encoding = request.accept_encodings.best_match(self.encodings)
+        if encoding is None:
+            return response
+        if response.is_streamed:
+            response.response = self.stream(response.response, encoding)
+            response.headers.pop("Content-Length", None)
+        else:
+            body = response.get_data()
+            if len(body) < self.min_size:
+                return response
+            response.set_data(self.compressed_body(body, encoding, response.get_etag()[0]))
+        response.headers["Content-Encoding"] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+    def compressed_body(self, body: bytes, encoding: str, etag: str | None) -> bytes:
+        """
+        Compress a whole body, reusing the bytes compressed for the same path, ETag and encoding.
+        """
+        key = (request.path, etag, encoding)
+        if etag is not None:
+            with self.lock:
+                cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        encoder = ENCODERS[encoding]()
+        compressed = encoder.compress(body) + encoder.finish()
+        if etag is not None:
+            with self.lock:
+                self.cache[key] = compressed
+                if len(self.cache) > CACHE_SIZE:
+                    del self.cache[next(iter(self.cache))]
+        return compressed
+
+    def stream(self, chunks, encoding: str):
+        """
+        Compress a streamed body chunk by chunk, flushing the encoder after every chunk.
+        """
+        encoder = ENCODERS[encoding]()
+        try:
+            for chunk in chunks:
+                data = encoder.compress(chunk.encode() if isinstance(chunk, str) else chunk)
+                if data:
+                    yield data
+            yield encoder.finish()
+        finally:
+            if hasattr(chunks, "close"):
+                chunks.close()
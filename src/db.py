@@ -1,30 +1,287 @@
+import os
+import re
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import column, event, inspect, table
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.pool import QueuePool
 
 db = SQLAlchemy()
+
+# Engine profiles, selected with the DB_PROFILE environment variable.
+# "pragmas" are applied to every new SQLite connection, and "pool" configures the engine's connection pool.
+ENGINE_PROFILES = {
+    "default": {
+        "pragmas": {"busy_timeout": 5000},
+        "pool": {},
+    },
+    "production": {
+        "pragmas": {
+            "journal_mode": "WAL",  # Readers no longer block on writers, and writers no longer block readers
+            "synchronous": "NORMAL",  # Safe with WAL, fsyncs at checkpoints instead of on every commit
+            "mmap_size": 268435456,  # 256 MiB of the db file read through memory mapping
+            "cache_size": -65536,  # 64 MiB page cache per connection (negative values are KiB)
+            "busy_timeout": 5000,  # Wait up to 5s for a competing writer instead of failing with "database is locked"
+            "temp_store": "MEMORY",
+        },
+        "pool": {"pool_size": 10, "max_overflow": 20, "pool_timeout": 30},
+    },
+}
+# Version of the schema defined by the models, stored in the db file as PRAGMA user_version.
+# Bump it with every change to the models, and bring older databases up to date in migrate_db.
+SCHEMA_VERSION = 3
+# PRAGMAs and pool settings that can be overridden one by one, as SQLITE_<PRAGMA> and DB_<SETTING> environment variables
+SQLITE_PRAGMAS = ("journal_mode", "synchronous", "mmap_size", "cache_size", "busy_timeout", "temp_store")
+POOL_SETTINGS = ("pool_size", "max_overflow", "pool_timeout", "pool_recycle")
 class Product(db.Model):
     """
-    Model for Product table in db, configuring it with id, name and price columns.
+    Model for Product table in db, configuring it with id, name, price_cents and stock columns.
+    Prices are stored as integer cents, and 'price' gives the amount in dollars.
+    'stock' is the quantity left to sell, or NULL for a product whose inventory is not tracked.
+    The integrity rules enforced on writes are also declared as constraints, so reads can trust the rows.
+    Names compare case-insensitively (NOCASE), so name prefix searches and sorting can use the name index.
     """
+    __table_args__ = (
+        db.CheckConstraint("price_cents > 0", name="ck_product_price_positive"),
+        db.CheckConstraint("name <> ''", name="ck_product_name_not_empty"),
+        db.CheckConstraint("stock >= 0", name="ck_product_stock_not_negative"),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
-    price = db.Column(db.Float, nullable=False)
+    name = db.Column(db.String(100, collation="NOCASE"), nullable=False, index=True)
+    price_cents = db.Column(db.Integer, nullable=False, index=True)
+    stock = db.Column(db.Integer, nullable=True)
+
+    @property
+    def price(self) -> float:
+        return self.price_cents / 100
 
     def __repr__(self):
         return f'<Product {self.name}>'
 
+class Sale(db.Model):
+    """
+    Model for Sale table in db, the ledger of completed sales, configuring it with id, total_sale_price_cents,
+    discount and created_at columns.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    total_sale_price_cents = db.Column(db.Integer, nullable=False)
+    discount = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<Sale {self.id}>'
+
+class SaleLineItem(db.Model):
+    """
+    Model for SaleLineItem table in db, the line items of a recorded Sale, configuring it with id, sale_id,
+    product_id, quantity, price_cents and discount_cents columns.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    sale_id = db.Column(db.Integer, db.ForeignKey("sale.id"), nullable=False, index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey("product.id"), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    price_cents = db.Column(db.Integer, nullable=False)
+    discount_cents = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return f'<SaleLineItem {self.sale_id}:{self.product_id}>'
+
+class CatalogVersion(db.Model):
+    """
+    Model for the single-row CatalogVersion table in db, holding a counter that every catalog write bumps,
+    so that all worker processes can tell whether the catalog changed without reading the products table.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=1)
+
+    def __repr__(self):
+        return f'<CatalogVersion {self.version}>'
+
+# FTS5 full-text index over the product names, kept in sync with the product table by triggers.
+# It is an external-content table: it only stores the index, and reads the names from the product table.
+PRODUCT_SEARCH_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS product_fts USING fts5("
+    "name, content='product', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "CREATE TRIGGER IF NOT EXISTS product_fts_insert AFTER INSERT ON product BEGIN "
+    "INSERT INTO product_fts (rowid, name) VALUES (new.id, new.name); END",
+    "CREATE TRIGGER IF NOT EXISTS product_fts_delete AFTER DELETE ON product BEGIN "
+    "INSERT INTO product_fts (product_fts, rowid, name) VALUES ('delete', old.id, old.name); END",
+    "CREATE TRIGGER IF NOT EXISTS product_fts_update AFTER UPDATE OF name ON product BEGIN "
+    "INSERT INTO product_fts (product_fts, rowid, name) VALUES ('delete', old.id, old.name); "
+    "INSERT INTO product_fts (rowid, name) VALUES (new.id, new.name); END",
+)
+# Core construct for querying the FTS5 table, which is not part of the models' metadata
+product_search = table("product_fts", column("rowid"), column("product_fts"))
+
+def load_engine_profile(environ=None) -> tuple[dict, dict]:
+    """
+    Build the SQLite PRAGMAs and SQLAlchemy engine options from the environment.
+
+    The DB_PROFILE variable selects a preset from ENGINE_PROFILES ("default" when unset), and any
+    SQLITE_<PRAGMA> or DB_<SETTING> variable overrides the matching value of that preset,
+    e.g. SQLITE_SYNCHRONOUS=FULL or DB_POOL_SIZE=20.
+
+    Args:
+        environ (dict, optional): The environment to read from, defaults to os.environ.
+    Returns:
+        tuple[dict, dict]: The PRAGMAs to apply on connect, and the options for SQLALCHEMY_ENGINE_OPTIONS.
+    Raises:
+        ValueError: If the profile is unknown, or an override has an invalid value.
+    """
+    environ = os.environ if environ is None else environ
+    name = environ.get("DB_PROFILE", "default")
+    if name not in ENGINE_PROFILES:
+        raise ValueError(f"DB_PROFILE must be one of: {', '.join(ENGINE_PROFILES)}.")
+    pragmas = dict(ENGINE_PROFILES[name]["pragmas"])
+    pool = dict(ENGINE_PROFILES[name]["pool"])
+
+    for pragma in SQLITE_PRAGMAS:
+        value = environ.get(f"SQLITE_{pragma.upper()}")
+        if value:
+            # PRAGMA values cannot be bound as parameters, so only plain words and integers are accepted
+            if not re.fullmatch(r"-?\w+", value):
+                raise ValueError(f"SQLITE_{pragma.upper()} must be a word or an integer.")
+            pragmas[pragma] = value
+    for setting in POOL_SETTINGS:
+        value = environ.get(f"DB_{setting.upper()}")
+        if value:
+            if not re.fullmatch(r"-?\d+", value):
+                raise ValueError(f"DB_{setting.upper()} must be an integer.")
+            pool[setting] = int(value)
+
+    engine_options = {"poolclass": QueuePool, **pool} if pool else {}
+    return pragmas, engine_options
+
+def apply_pragmas(engine, pragmas: dict) -> None:
+    """
+    Registers a listener that applies the given PRAGMAs to every new connection of the engine.
+    """
+    if not pragmas:
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+def rebuild_table(connection, table, expressions: dict) -> None:
+    """
+    Rebuild an existing table with the model's current definition, copying its rows over.
+    SQLite cannot alter column types, so the table is recreated under a temporary name, filled,
+    and swapped in place of the old one.
+
+    Args:
+        connection: The connection to run the rebuild on, inside a transaction.
+        table (Table): The model's table, with its current definition.
+        expressions (dict): SQL expressions computing new columns from the old ones, by column name.
+    """
+    temporary = f"{table.name}__new"
+    ddl = str(CreateTable(table).compile(connection)).replace(f"CREATE TABLE {table.name} (", f"CREATE TABLE {temporary} (", 1)
+    columns = [column.name for column in table.columns]
+    connection.exec_driver_sql(ddl)
+    connection.exec_driver_sql(
+        f"INSERT INTO {temporary} ({', '.join(columns)}) "
+        f"SELECT {', '.join(expressions.get(name, name) for name in columns)} FROM {table.name}"
+    )
+    connection.exec_driver_sql(f"DROP TABLE {table.name}")
+    connection.exec_driver_sql(f"ALTER TABLE {temporary} RENAME TO {table.name}")
+    for index in table.indexes:
+        index.create(connection)
+
+def migrate_db(connection) -> None:
+    """
+    Bring the tables of an existing database up to the current models.
+    create_all only creates missing tables, so changes to existing ones are applied here:
+        - Float dollar amounts to integer cents, in the product, sale and sale_line_item tables.
+        - Case-insensitive (NOCASE) product names, and the indexes on the product name and price.
+        - The product stock column, NULL (not tracked) for the existing products.
+    """
+    inspector = inspect(connection)
+    tables = inspector.get_table_names()
+
+    def columns(table_name):
+        return {column["name"] for column in inspector.get_columns(table_name)}
+
+    def definition(table_name):
+        return connection.exec_driver_sql("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)).scalar()
+
+    to_cents = "CAST(ROUND({} * 100) AS INTEGER)"
+    if "product" in tables:
+        product_columns = columns("product")
+        expressions = {}
+        if "price_cents" not in product_columns:
+            expressions["price_cents"] = to_cents.format("price")
+        if "stock" not in product_columns:
+            expressions["stock"] = "NULL"
+        if expressions or "NOCASE" not in definition("product"):
+            rebuild_table(connection, Product.__table__, expressions)
+        for index in Product.__table__.indexes:
+            index.create(connection, checkfirst=True)
+    if "sale" in tables and "total_sale_price_cents" not in columns("sale"):
+        rebuild_table(connection, Sale.__table__, {"total_sale_price_cents": to_cents.format("total_sale_price")})
+    if "sale_line_item" in tables and "price_cents" not in columns("sale_line_item"):
+        rebuild_table(connection, SaleLineItem.__table__, {
+            "price_cents": to_cents.format("price"),
+            "discount_cents": to_cents.format("discount"),
+        })
+
+def create_product_search(connection) -> None:
+    """
+    Create the FTS5 index over the product names and its sync triggers, if missing.
+    A newly created index is filled from the rows already in the product table.
+    """
+    created = connection.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE name = 'product_fts'").first() is None
+    for statement in PRODUCT_SEARCH_DDL:
+        connection.exec_driver_sql(statement)
+    if created:
+        connection.exec_driver_sql("INSERT INTO product_fts (product_fts) VALUES ('rebuild')")
+
 def init_db(app):
     """
-    Initializes the database and populates it with initial products if empty.
+    Initializes the database, bringing its schema up to SCHEMA_VERSION.
+    The PRAGMAs in app.config['SQLITE_PRAGMAS'] are applied to every connection, starting with the first one.
+
+    A database already at SCHEMA_VERSION is left as-is, so booting only costs a PRAGMA read.
+    Otherwise the existing tables are migrated, the missing ones created, and the version stored,
+    all in one transaction. The initial catalog is inserted separately, with seed_db.
     """
     db.init_app(app)
     with app.app_context():
-        db.create_all()
-        # If the products table is empty, insert the initial catalog
-        if Product.query.count() == 0:
-            initial_products = [
-                Product(id=1, name="Chrome Toaster", price=100),
-                Product(id=2, name="Copper Kettle", price=49.99),
-                Product(id=3, name="Mixing Bowl", price=20),
-            ]
-            db.session.add_all(initial_products)
-            db.session.commit()
\ No newline at end of file
+        apply_pragmas(db.engine, app.config.get("SQLITE_PRAGMAS", {}))
+        with db.engine.connect() as connection:
+            if connection.exec_driver_sql("PRAGMA user_version").scalar() == SCHEMA_VERSION:
+                return
+        with db.engine.begin() as connection:
+            migrate_db(connection)
+            db.metadata.create_all(connection)
+            create_product_search(connection)
+            # If the catalog version counter is missing, start it at version 1
+            if connection.execute(db.select(CatalogVersion.id)).first() is None:
+                connection.execute(db.insert(CatalogVersion).values(id=1, version=1))
+            connection.exec_driver_sql(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+def seed_db(app) -> int:
+    """
+    Populates the database with the initial catalog if the products table is empty, bumping the catalog
+    version so running workers drop their cached listing, and refreshing the catalog snapshot. Run with `flask seed`.
+
+    Returns:
+        int: The number of products inserted.
+    """
+    with app.app_context():
+        if db.session.execute(db.select(Product.id).limit(1)).first() is not None:
+            return 0
+        initial_products = [
+            Product(id=1, name="Chrome Toaster", price_cents=10000),
+            Product(id=2, name="Copper Kettle", price_cents=4999),
+            Product(id=3, name="Mixing Bowl", price_cents=2000),
+        ]
+        db.session.add_all(initial_products)
+        db.session.execute(db.update(CatalogVersion).values(version=CatalogVersion.version + 1))
+        db.session.commit()
+        # Publishing the seeded products to the catalog snapshot read by the app's workers, when it has one
+        products_service = getattr(app, "products_service", None)
+        if products_service is not None:
+            products_service.refresh_snapshot()
+        return len(initial_products)
\ No newline at end of file
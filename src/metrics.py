@@ -0,0 +1,196 @@
+import bisect
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from flask import g, has_request_context, request, Response
+from sqlalchemy import event
+
+# Histogram buckets, in seconds for latencies and in statements for the SQL statements per request
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100, 250, 1000)
+
+def load_metrics_config(environ=None) -> dict:
+    """
+    Build the instrumentation configuration from the METRICS_* environment variables:
+        - METRICS_ENABLED (default 1): record metrics and serve them on /metrics.
+        - METRICS_SERVER_TIMING (default 0): add a Server-Timing header to every response.
+        - METRICS_PHASE_SAMPLE_RATE (default 0.1): fraction of requests whose service phases are timed.
+
+    Args:
+        environ (dict, optional): The environment to read from, defaults to os.environ.
+    Returns:
+        dict: The keyword arguments for Metrics.
+    Raises:
+        ValueError: If the sample rate is not a number between 0 and 1.
+    """
+    environ = os.environ if environ is None else environ
+    try:
+        sample_rate = float(environ.get("METRICS_PHASE_SAMPLE_RATE", "0.1"))
+    except ValueError:
+        sample_rate = -1
+    if not 0 <= sample_rate <= 1:
+        raise ValueError("METRICS_PHASE_SAMPLE_RATE must be a number between 0 and 1.")
+    return {
+        "enabled": environ.get("METRICS_ENABLED", "1") not in ("0", "false", "False"),
+        "server_timing": environ.get("METRICS_SERVER_TIMING", "0") in ("1", "true", "True"),
+        "phase_sample_rate": sample_rate,
+    }
+
+class Histogram:
+    """
+    Prometheus-style histogram, holding one series of bucket counts, sum and count per label values tuple.
+    """
+
+    def __init__(self, name: str, description: str, label_names: tuple, buckets: tuple):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, labels: tuple, value: float) -> None:
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series.setdefault(labels, [[0] * (len(self.buckets) + 1), 0.0, 0])
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in sorted(self.series.items()):
+            label_text = ",".join(f'{n}="{escape_label(v)}"' for n, v in zip(self.label_names, labels))
+            prefix = f"{label_text}," if label_text else ""
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {total}")
+            lines.append(f"{self.name}_count{{{label_text}}} {count}")
+        return lines
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Metrics:
+    """
+    Request and SQL instrumentation for the app, served in the Prometheus text format on /metrics.
+
+    Records the latency of every request by route, the count and duration of the SQL statements each
+    request runs, and the duration of the named phases inside the services. Phases are only timed for a
+    sampled fraction of requests, and the other requests skip their timing entirely.
+    Metrics are kept per process, so each worker exposes its own.
+    """
+
+    def __init__(self, enabled: bool = True, server_timing: bool = False, phase_sample_rate: float = 0.1):
+        self.enabled = enabled
+        self.server_timing = server_timing
+        self.phase_sample_rate = phase_sample_rate
+        self.lock = threading.Lock()
+        self.request_duration = Histogram(
+            "http_request_duration_seconds", "Latency of HTTP requests by route.",
+            ("method", "route", "status"), LATENCY_BUCKETS)
+        self.request_sql_statements = Histogram(
+            "http_request_sql_statements", "SQL statements executed per HTTP request by route.",
+            ("method", "route"), COUNT_BUCKETS)
+        self.request_sql_duration = Histogram(
+            "http_request_sql_duration_seconds", "Time spent in SQL statements per HTTP request by route.",
+            ("method", "route"), LATENCY_BUCKETS)
+        self.sql_duration = Histogram(
+            "sql_statement_duration_seconds", "Latency of individual SQL statements, including background writes.",
+            (), LATENCY_BUCKETS)
+        self.phase_duration = Histogram(
+            "service_phase_duration_seconds", "Latency of the named phases inside the services, for sampled requests.",
+            ("phase",), LATENCY_BUCKETS)
+
+    def init_app(self, app, engines: list) -> None:
+        """
+        Register the request hooks, the SQL listeners on the given engines, and the /metrics route.
+        Does nothing when metrics are disabled.
+        """
+        if not self.enabled:
+            return
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+        for engine in engines:
+            event.listen(engine, "before_cursor_execute", self.before_cursor_execute)
+            event.listen(engine, "after_cursor_execute", self.after_cursor_execute)
+        app.add_url_rule("/metrics", "metrics", self.render)
+
+    def observe(self, histogram: Histogram, labels: tuple, value: float) -> None:
+        with self.lock:
+            histogram.observe(labels, value)
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Time the enclosed block as the named service phase, if the current request is sampled.
+        """
+        if not self.enabled or not self.sampled():
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            self.observe(self.phase_duration, (name,), duration)
+            if has_request_context() and "metrics_phases" in g:
+                g.metrics_phases.append((name, duration))
+
+    def sampled(self) -> bool:
+        """
+        Whether phases should be timed, decided once per request (or per call outside of requests).
+        """
+        if has_request_context() and "metrics_sampled" in g:
+            return g.metrics_sampled
+        return random.random() < self.phase_sample_rate
+
+    def start_request(self) -> None:
+        g.metrics_start = time.perf_counter()
+        g.metrics_sql_count = 0
+        g.metrics_sql_time = 0.0
+        g.metrics_sampled = random.random() < self.phase_sample_rate
+        g.metrics_phases = []
+
+    def finish_request(self, response: Response) -> Response:
+        if "metrics_start" not in g:
+            return response
+        duration = time.perf_counter() - g.metrics_start
+        route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+        self.observe(self.request_duration, (request.method, route, str(response.status_code)), duration)
+        self.observe(self.request_sql_statements, (request.method, route), g.metrics_sql_count)
+        self.observe(self.request_sql_duration, (request.method, route), g.metrics_sql_time)
+        if self.server_timing:
+            timings = [f"app;dur={duration * 1000:.3f}",
+                       f'sql;dur={g.metrics_sql_time * 1000:.3f};desc="{g.metrics_sql_count} statements"']
+            timings += [f"{name.replace('.', '-')};dur={d * 1000:.3f}" for name, d in g.metrics_phases]
+            response.headers["Server-Timing"] = ", ".join(timings)
+        return response
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_statement_start", []).append(time.perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("metrics_statement_start")
+        if not starts:
+            return
+        duration = time.perf_counter() - starts.pop()
+        self.observe(self.sql_duration, (), duration)
+        if has_request_context() and "metrics_sql_count" in g:
+            g.metrics_sql_count += 1
+            g.metrics_sql_time += duration
+
+    def render(self) -> Response:
+        """
+        GET /metrics returns every metric in the Prometheus text exposition format.
+        """
+        with self.lock:
+            lines = []
+            for histogram in (self.request_duration, self.request_sql_statements, self.request_sql_duration,
+                              self.sql_duration, self.phase_duration):
+                lines += histogram.render()
+        return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,97 @@
+"""
+Integer-cents pricing engine.
+
+Money is stored and calculated as integer cents, so totals and discount splits are exact and
+deterministic. Amounts are only converted to floats (dollars) at the edges, to keep the response shape.
+"""
+
+# Bounds of the amounts the API accepts. A sale total is at most MAX_PRICE * 100 * MAX_QUANTITY * MAX_LINE_ITEMS
+# cents (5 * 10**15), below 2**53, so every amount fits in the int64 columns of SQLite and its float dollar
+# amount converts back to the same cents.
+MAX_PRICE = 1_000_000  # dollars
+MAX_QUANTITY = 10_000
+MAX_LINE_ITEMS = 5_000
+MAX_DISCOUNT = 1_000_000_000  # dollars
+
+def to_cents(amount: int | float) -> int:
+    """
+    Convert a dollar amount with at most 2 decimal places to integer cents.
+    """
+    return round(amount * 100)
+
+def from_cents(cents: int) -> float:
+    """
+    Convert integer cents to a float dollar amount, e.g. 24999 -> 249.99.
+    """
+    return cents / 100
+
+def div_round_half_even(numerator: int, denominator: int) -> int:
+    """
+    Divide two integers, rounding the exact quotient to the nearest integer, with ties to even.
+    """
+    quotient, remainder = divmod(numerator, denominator)
+    if 2 * remainder > denominator or (2 * remainder == denominator and quotient % 2 == 1):
+        quotient += 1
+    return quotient
+
+def line_totals(quantities: list[int], unit_prices: list[int]) -> tuple[list[int], int]:
+    """
+    Compute the total of each line item (quantity * unit price) and the sum of all of them, in cents.
+
+    Args:
+        quantities (list[int]): The quantity of each line item.
+        unit_prices (list[int]): The unit price of each line item, in cents.
+    Returns:
+        tuple[list[int], int]: The line totals and the sale total, in cents.
+    """
+    totals = [quantity * price for quantity, price in zip(quantities, unit_prices)]
+    return totals, sum(totals)
+
+def split_discount(total_discount: int, num_items: int) -> list[int]:
+    """
+    Split a flat discount evenly across line items, in cents. Every item gets the rounded even share,
+    and the last item absorbs the rounding difference, so the shares always add up to the discount.
+
+    Args:
+        total_discount (int): The discount to split, in cents.
+        num_items (int): The number of line items.
+    Returns:
+        list[int]: The discount of each line item, in cents.
+    """
+    share = div_round_half_even(total_discount, num_items)
+    return [share] * (num_items - 1) + [total_discount - share * (num_items - 1)]
+
+def price_cart(line_items: list[dict], discount: int, prices) -> dict:
+    """
+    Price a validated cart: each line item's "price" is its quantity * unit price, and the flat
+    discount is split evenly across the line items. Amounts are calculated in integer cents and
+    converted to dollars for the response.
+
+    Args:
+        line_items (list[dict]): The validated line items, each with "id" and "quantity".
+        discount (int): The flat discount for the sale, in dollars.
+        prices (Mapping[int, int]): The unit price of every product in the cart, in cents, by product ID.
+    Returns:
+        dict: The sale, with its priced "line_items" and "total_sale_price".
+    """
+    quantities = [item["quantity"] for item in line_items]
+    unit_prices = [prices[item["id"]] for item in line_items]
+    totals, sale_total = line_totals(quantities, unit_prices)
+    discounts = split_discount(to_cents(discount), len(line_items))
+    return {
+        "line_items": [
+            {"id": item["id"], "quantity": item["quantity"], "price": from_cents(total), "discount": from_cents(item_discount)}
+            for item, total, item_discount in zip(line_items, totals, discounts)
+        ],
+        "total_sale_price": from_cents(sale_total)
+    }
+
+def price_carts(carts: list[tuple], prices) -> list[dict]:
+    """
+    Price many validated carts against the same unit prices.
+
+    Args:
+        carts (list[tuple]): The (line_items, discount) of each cart.
+        prices (Mapping[int, int]): The unit price of every product in the carts, in cents, by product ID.
+    """
+    return [price_cart(line_items, discount, prices) for line_items, discount in carts]
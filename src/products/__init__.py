@@ -1,2 +1,2 @@
 from .routes import products_bp
-from .service import ProductService
\ No newline at end of file
+from .service import ProductService
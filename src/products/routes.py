@@ -7,8 +7,19 @@ products_bp = Blueprint("products", __name__, url_prefix="/products")
 def get_products():
     """
     GET /products returns a list of products.
+    Supports keyset pagination with ?after_id=&limit=, streaming with ?stream=json|ndjson,
+    and search with ?name=&q=&min_price=&max_price=&sort=&limit=.
     """
-    return current_app.products_service.list_products()
+    return current_app.products_service.list_products(
+        after_id=request.args.get("after_id"),
+        limit=request.args.get("limit"),
+        stream=request.args.get("stream"),
+        name=request.args.get("name"),
+        q=request.args.get("q"),
+        min_price=request.args.get("min_price"),
+        max_price=request.args.get("max_price"),
+        sort=request.args.get("sort"),
+    )
 
 @products_bp.post("")
 def post_product():
@@ -16,4 +27,19 @@ def post_product():
     POST /products adds the new product to the db,
     and returns the new product.
     """
-    return current_app.products_service.create_product(request.get_json())
\ No newline at end of file
+    return current_app.products_service.create_product(request.get_json())
+
+@products_bp.post("/bulk")
+def post_products_bulk():
+    """
+    POST /products/bulk adds many products to the db from a JSON array,
+    or from a streamed NDJSON body (Content-Type: application/x-ndjson),
+    and returns the assigned ids.
+    """
+    ndjson = request.mimetype == "application/x-ndjson"
+    return current_app.products_service.create_products_bulk(
+        request.stream if ndjson else request.get_json(silent=True),
+        ndjson=ndjson,
+        chunk_size=request.args.get("chunk_size"),
+        commit=request.args.get("commit"),
+    )
@@ -1,17 +1,78 @@
 # from db import db, Product
-from flask import jsonify
+import hashlib
+import re
+import time
+from itertools import chain
+from flask import jsonify, current_app, request, stream_with_context, url_for, Response
+from pricing import MAX_PRICE, from_cents, to_cents
 
 class ProductService:
-    def __init__(self, db, product_model):
+    # Largest page a client may request with ?limit=, and the page size used when only ?after_id= is given
+    MAX_PAGE_SIZE = 1000
+    # Number of rows pulled from the server-side cursor per round trip when streaming the catalog
+    STREAM_BATCH_SIZE = 1000
+    STREAM_MIMETYPES = {"json": "application/json", "ndjson": "application/x-ndjson"}
+    # Default and maximum number of rows sent to the db per executemany batch by POST /products/bulk
+    BULK_CHUNK_SIZE = 5000
+    MAX_BULK_CHUNK_SIZE = 50000
+    # Max value of an integer query parameter, the largest id SQLite's INTEGER can hold
+    MAX_QUERY_INT = 2**63 - 1
+    # Max stock of a product, keeps stock updates well within SQLite's int64
+    MAX_STOCK = 10**12
+    BULK_COMMIT_MODES = ("all", "chunk")
+    # Seconds shared caches may serve a catalog response before revalidating it with If-None-Match
+    CACHE_MAX_AGE = 0
+    # Orders accepted by ?sort=, each ascending, or descending with a "-" prefix
+    SORT_FIELDS = ("id", "name", "price")
+    # Seconds between the checks of the snapshot's version against the db, catching a refresh that was missed
+    SNAPSHOT_CHECK_INTERVAL = 1.0
+
+    def __init__(self, db, product_model, catalog_version_model, search_table, metrics, catalog_snapshot=None):
         self.db = db
         self.Product = product_model
+        self.CatalogVersion = catalog_version_model
+        # FTS5 table indexing the product names, queried by ?q= full-text searches
+        self.search_table = search_table
+        self.metrics = metrics
+        # Rendered GET /products body for the catalog version it was rendered at, as a (version, bytes) tuple
+        self.rendered_catalog = None
+        # Memory-mapped catalog shared by the worker processes, serving the listing and pages when present
+        self.catalog_snapshot = catalog_snapshot
+        # When this worker last checked the snapshot's version against the db, as a time.monotonic() value
+        self.snapshot_checked_at = 0.0
 
-    def list_products(self) -> list[dict]:
+    def list_products(self, after_id=None, limit=None, stream=None,
+                      name=None, q=None, min_price=None, max_price=None, sort=None) -> list[dict]:
         """
-        Retrieve all products from the database.
+        Retrieve products from the database.
+
+        Without parameters, queries the Product model to fetch all product records and returns a list
+        of dictionaries, where each dictionary contains the product's 'id', 'name', and 'price'.
+
+        The full listing and pages carry a strong ETag derived from the catalog version, and a request whose
+        If-None-Match matches it is answered with 304 without touching the products table. The full listing
+        and pages are served from the catalog snapshot shared by the worker processes, with no db query.
+        Without a snapshot, the full listing is rendered once per catalog version and served from memory afterwards.
 
-        Queries the Product model to fetch all product records and returns a list of dictionaries,
-        where each dictionary contains the product's 'id', 'name', and 'price'.
+        With 'after_id' and/or 'limit', returns a single keyset-paginated page of products ordered by id,
+        starting after 'after_id'. A full page carries a 'Link: <...>; rel="next"' header pointing at the next page.
+
+        With 'stream' set to "json" or "ndjson", the products are streamed from a server-side cursor as
+        JSON array chunks or newline-delimited JSON, keeping memory bounded whatever the catalog size.
+
+        With any of the search parameters, returns the first 'limit' matching products in the requested
+        order, served from the name and price indexes and the FTS5 name index. An empty result is returned
+        as an empty list. Search parameters cannot be combined with 'after_id' or 'stream'.
+
+        Args:
+            after_id (str or int, optional): Only return products with an id greater than this value.
+            limit (str or int, optional): Maximum number of products to return, at most MAX_PAGE_SIZE.
+            stream (str, optional): Streaming format, either "json" or "ndjson".
+            name (str, optional): Only return products whose name starts with this prefix, ignoring case.
+            q (str, optional): Only return products whose name contains all these words, the last one as a prefix.
+            min_price (str, optional): Only return products priced at least this amount, in dollars.
+            max_price (str, optional): Only return products priced at most this amount, in dollars.
+            sort (str, optional): One of SORT_FIELDS, prefixed with "-" for descending order. Defaults to "id".
 
         Returns:
             list[dict]: A list of dictionaries representing products.
@@ -23,18 +84,514 @@ class ProductService:
                         ]
         """
         try:
-            product_list = self.Product.query.all()
-            self.validate_product_list(product_list)
-            return jsonify(self.transform_product_list(product_list)), 200
+            after_id, limit, stream = self.validate_list_params(after_id, limit, stream)
+            search = self.validate_search_params(name, q, min_price, max_price, sort, after_id, stream)
+        except (ValueError, TypeError) as e:
+            return jsonify({"error": str(e)}), 422
+        try:
+            if stream:
+                return self.stream_products(after_id, limit, stream)
+            view = self.snapshot_view() if not search else None
+            if view is not None:
+                version = view.version
+            else:
+                # The version and the products are read from the same snapshot of the db, so the ETag matches the body
+                self.begin_read(self.db.session.connection())
+                version = self.catalog_version()
+            etag = self.catalog_etag(version, after_id, limit, search)
+            if request.if_none_match.contains_weak(etag):
+                return self.cacheable(Response(status=304), etag)
+            if search:
+                response, status = self.search_products(search, limit)
+                return self.cacheable(response, etag), status
+            if view is not None:
+                response, status = self.snapshot_response(view, after_id, limit)
+                return self.cacheable(response, etag), status
+            if after_id is None and limit is None:
+                return self.cacheable(self.render_catalog(version), etag), 200
+            response, status = self.list_products_page(after_id, limit)
+            return self.cacheable(response, etag), status
         except (ValueError, TypeError) as e:
             return jsonify({"error": str(e)}), 404
 
+    def render_catalog(self, version: int) -> Response:
+        """
+        Build the full GET /products response, reusing the bytes rendered for 'version' when available.
+
+        Args:
+            version (int): The current catalog version.
+        """
+        body = self.cached_catalog(version)
+        if body is None:
+            with self.metrics.phase("products.query"):
+                product_list = self.fetch_rows(self.product_rows_query())
+            body = self.cache_catalog(version, product_list)
+        return self.catalog_response(body)
+
+    def snapshot_view(self):
+        """
+        Return the current view of the catalog snapshot, or None to read from the db, when there is no snapshot.
+
+        Every SNAPSHOT_CHECK_INTERVAL seconds, the snapshot's version is also compared with the catalog version
+        in the db. A snapshot left behind by a write whose refresh never ran, e.g. in a process that died right
+        after its commit, is then refreshed, so it cannot hide the write for longer than the interval.
+        """
+        if self.catalog_snapshot is None:
+            return None
+        view = self.catalog_snapshot.view()
+        now = time.monotonic()
+        if view is not None and now - self.snapshot_checked_at >= self.SNAPSHOT_CHECK_INTERVAL:
+            self.snapshot_checked_at = now
+            if view.version != self.catalog_version():
+                self.refresh_snapshot()
+                view = self.catalog_snapshot.view()
+        return view
+
+    def snapshot_response(self, view, after_id: int | None, limit: int | None):
+        """
+        Serve the full listing or a page from the JSON pre-rendered in the catalog snapshot, reporting
+        an empty catalog and linking to the next page like the db path.
+        """
+        with self.metrics.phase("products.snapshot"):
+            if after_id is None and limit is None:
+                if not view.count:
+                    raise ValueError("No products found.")
+                return self.catalog_response(view.listing()), 200
+            limit = limit if limit is not None else self.MAX_PAGE_SIZE
+            body, count, last_id = view.page(after_id, limit)
+        if not count and after_id is None:
+            raise ValueError("No products found.")
+        response = self.catalog_response(body)
+        if count == limit:
+            self.link_next_page(response, last_id, limit)
+        return response, 200
+
+    def refresh_snapshot(self, rebuild: bool = False) -> None:
+        """
+        Bring the catalog snapshot up to the committed catalog version. Must be called after every committed
+        write to the products table, even when the request fails afterwards, and is called on startup.
+
+        Refreshes are coalesced across the workers: when another worker holds the writers' lock, this one
+        returns right away instead of waiting for it, and the lock holder checks the catalog version again
+        once it has released the lock, publishing the writes committed in the meantime. Products in none of
+        the published snapshots yet are still found by the sales lookups, which fall back to the db, and a
+        write still missing after that second round is caught by the version check of 'snapshot_view'.
+        If the snapshot cannot be refreshed, it is removed, so the workers fall back to the db rather than
+        serve a stale catalog.
+
+        Args:
+            rebuild (bool): Rebuild the snapshot from the whole catalog, even if it could be appended to.
+                The lock is then waited for, since the lock holder may only be appending.
+        """
+        if self.catalog_snapshot is None:
+            return
+        try:
+            # A second round publishes the writes whose refreshes were left to this worker while it held the lock
+            for _ in range(2):
+                with self.catalog_snapshot.writing(block=rebuild) as locked:
+                    if not locked:
+                        return
+                    version = self.publish_snapshot(rebuild)
+                with self.db.engine.connect() as connection:
+                    if connection.execute(self.catalog_version_query()).scalar_one() == version:
+                        return
+                rebuild = False
+        except Exception:
+            # The write is already committed, so it still succeeds, and the workers read it from the db
+            current_app.logger.exception("Failed to refresh the catalog snapshot, serving the catalog from the db.")
+            self.catalog_snapshot.discard()
+
+    def publish_snapshot(self, rebuild: bool) -> int:
+        """
+        Publish the committed catalog to the snapshot, unless it is already current. Must be called while
+        holding the snapshot writers' lock.
+
+        The version and products are read in one transaction, so the snapshot swapped in is never older than
+        one already published by another worker. Products inserted since the current snapshot are appended
+        to it, rendering only them, while any other change rebuilds it from the whole catalog. Writes that
+        change existing products must pass 'rebuild'.
+
+        Args:
+            rebuild (bool): Rebuild the snapshot from the whole catalog, even if it could be appended to.
+        Returns:
+            int: The catalog version of the published snapshot.
+        """
+        with self.db.engine.connect() as connection:
+            self.begin_read(connection)
+            version = connection.execute(self.catalog_version_query()).scalar_one()
+            view = self.catalog_snapshot.view()
+            if view is not None and view.version == version and not rebuild:
+                return version
+            query = self.db.select(
+                self.Product.id, self.Product.name, self.Product.price_cents, self.Product.stock.is_not(None)
+            ).order_by(self.Product.id)
+            base = None
+            if view is not None and view.count and not rebuild:
+                rows = connection.execute(query.where(self.Product.id > view.ids[-1])).all()
+                count = connection.execute(self.db.select(self.db.func.count(self.Product.id))).scalar_one()
+                base = view if rows and count == view.count + len(rows) else None
+            if base is None:
+                rows = connection.execute(query).all()
+            self.catalog_snapshot.publish(version, self.render_snapshot_rows(rows), base)
+            return version
+
+    def render_snapshot_rows(self, rows: list) -> list[tuple]:
+        """
+        Validate and render (id, name, price_cents, tracked) rows into the (id, price_cents, tracked, JSON bytes)
+        entries of the catalog snapshot, each product rendered like in the GET /products body.
+        """
+        product_list = [row[:3] for row in rows]
+        if product_list:
+            self.validate_product_list(product_list)
+        dumps = current_app.json.dumps
+        return [
+            (row[0], row[2], row[3], dumps(product, separators=(",", ":")).encode())
+            for row, product in zip(rows, self.transform_product_list(product_list))
+        ]
+
+    def product_rows_query(self):
+        """
+        Build the statement selecting only the id, name and price_cents columns of the products, ordered by id.
+        """
+        return self.db.select(self.Product.id, self.Product.name, self.Product.price_cents).order_by(self.Product.id)
+
+    def fetch_rows(self, query) -> list:
+        """
+        Execute a column statement with SQLAlchemy Core on the session's connection, returning compact
+        (id, name, price_cents) rows without going through the ORM's identity map and instrumentation.
+        """
+        return self.db.session.connection().execute(query).all()
+
+    def catalog_response(self, body: bytes) -> Response:
+        """
+        Wrap a rendered full listing into a JSON response.
+        """
+        return current_app.response_class(body, mimetype="application/json")
+
+    def cached_catalog(self, version: int) -> bytes | None:
+        """
+        Return the full listing rendered for 'version', or None if it has not been rendered yet.
+        """
+        rendered = self.rendered_catalog
+        if rendered is not None and rendered[0] == version:
+            return rendered[1]
+        return None
+
+    def cache_catalog(self, version: int, product_list: list) -> bytes:
+        """
+        Validate and render the full listing, keeping the bytes for 'version'.
+        """
+        with self.metrics.phase("products.validate"):
+            self.validate_product_list(product_list)
+        with self.metrics.phase("products.serialize"):
+            body = jsonify(self.transform_product_list(product_list)).get_data()
+        self.rendered_catalog = (version, body)
+        return body
+
+    def catalog_etag(self, version: int, after_id: int | None, limit: int | None, search: dict | None = None) -> str:
+        """
+        Build the ETag of a catalog response from the catalog version and the requested page or search.
+        """
+        if search:
+            digest = hashlib.sha1(repr(sorted(search.items())).encode()).hexdigest()[:16]
+            return f"{version}-{limit}-{digest}"
+        if after_id is None and limit is None:
+            return f"{version}"
+        return f"{version}-{after_id}-{limit}"
+
+    def cacheable(self, response: Response, etag: str) -> Response:
+        """
+        Attach the strong ETag and Cache-Control headers to a catalog response.
+        """
+        response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = self.CACHE_MAX_AGE
+        response.cache_control.must_revalidate = True
+        return response
+
+    def catalog_version(self) -> int:
+        """
+        Read the current catalog version shared by all worker processes.
+        """
+        with self.metrics.phase("products.version"):
+            return self.db.session.execute(self.catalog_version_query()).scalar_one()
+
+    def begin_read(self, connection) -> None:
+        """
+        Start a transaction on 'connection', unless it is already in one, so the statements that follow read
+        the same snapshot of the db. pysqlite only begins transactions before writes, which otherwise leaves
+        each SELECT to see the commits made since the previous one.
+        """
+        if not connection.connection.driver_connection.in_transaction:
+            connection.exec_driver_sql("BEGIN")
+
+    def catalog_version_query(self):
+        """
+        Build the statement selecting the current catalog version.
+        """
+        return self.db.select(self.CatalogVersion.version).where(self.CatalogVersion.id == 1)
+
+    def bump_catalog_version(self) -> None:
+        """
+        Increment the catalog version as part of the current transaction.
+        Must be called by every write to the products table, before it commits.
+        """
+        self.db.session.execute(
+            self.db.update(self.CatalogVersion)
+            .where(self.CatalogVersion.id == 1)
+            .values(version=self.CatalogVersion.version + 1)
+        )
+
+    def list_products_page(self, after_id: int | None, limit: int | None):
+        """
+        Retrieve a single keyset-paginated page of products, ordered by id.
+
+        An empty first page is reported like an empty catalog, while an empty page past the
+        end of the catalog is returned as an empty list.
+
+        Args:
+            after_id (int or None): Only return products with an id greater than this value.
+            limit (int or None): Maximum number of products to return, defaults to MAX_PAGE_SIZE.
+        """
+        with self.metrics.phase("products.query"):
+            page = self.fetch_rows(self.page_query(after_id, limit))
+        return self.page_response(page, after_id, limit)
+
+    def page_query(self, after_id: int | None, limit: int | None):
+        """
+        Build the statement selecting a keyset-paginated page of products, ordered by id.
+        """
+        query = self.product_rows_query()
+        if after_id is not None:
+            query = query.where(self.Product.id > after_id)
+        return query.limit(limit if limit is not None else self.MAX_PAGE_SIZE)
+
+    def page_response(self, page: list, after_id: int | None, limit: int | None):
+        """
+        Validate and render a page of products, linking to the next page when this one is full.
+        """
+        limit = limit if limit is not None else self.MAX_PAGE_SIZE
+        if page or after_id is None:
+            with self.metrics.phase("products.validate"):
+                self.validate_product_list(page)
+        with self.metrics.phase("products.serialize"):
+            response = jsonify(self.transform_product_list(page))
+        if len(page) == limit:
+            self.link_next_page(response, page[-1][0], limit)
+        return response, 200
+
+    def link_next_page(self, response: Response, last_id: int, limit: int) -> None:
+        """
+        Point the Link header of a full page at the next one.
+        """
+        next_url = url_for("products.get_products", after_id=last_id, limit=limit)
+        response.headers["Link"] = f'<{next_url}>; rel="next"'
+
+    def search_products(self, search: dict, limit: int | None):
+        """
+        Retrieve the products matching a search, in the requested order.
+
+        Args:
+            search (dict): The normalized search parameters, as returned by validate_search_params.
+            limit (int or None): Maximum number of products to return, defaults to MAX_PAGE_SIZE.
+        """
+        with self.metrics.phase("products.query"):
+            rows = self.fetch_rows(self.search_query(search, limit))
+        return self.search_response(rows)
+
+    def search_query(self, search: dict, limit: int | None):
+        """
+        Build the statement selecting the (id, name, price_cents) rows matching a search.
+
+        The name prefix is a LIKE 'prefix%' on the NOCASE name column, which SQLite serves as a range scan of
+        the name index. Words are matched on the FTS5 table, and prices with a range on the price index.
+        Ties of a name or price order are broken by id, so results are stable.
+        """
+        query = self.db.select(self.Product.id, self.Product.name, self.Product.price_cents)
+        if "name" in search:
+            prefix = search["name"].replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            query = query.where(self.Product.name.like(f"{prefix}%", escape="\\"))
+        if "q" in search:
+            matches = self.db.select(self.search_table.c.rowid).where(self.search_table.c.product_fts.op("MATCH")(search["q"]))
+            query = query.where(self.Product.id.in_(matches))
+        if "min_price" in search:
+            query = query.where(self.Product.price_cents >= search["min_price"])
+        if "max_price" in search:
+            query = query.where(self.Product.price_cents <= search["max_price"])
+        sort = search.get("sort", "id")
+        column = {"id": self.Product.id, "name": self.Product.name, "price": self.Product.price_cents}[sort.lstrip("-")]
+        order = [column.desc() if sort.startswith("-") else column]
+        if column is not self.Product.id:
+            order.append(self.Product.id)
+        return query.order_by(*order).limit(limit if limit is not None else self.MAX_PAGE_SIZE)
+
+    def search_response(self, rows: list):
+        """
+        Validate and render the products matching a search. No match is not an error, and gives an empty list.
+        """
+        if rows:
+            with self.metrics.phase("products.validate"):
+                self.validate_product_list(rows)
+        with self.metrics.phase("products.serialize"):
+            response = jsonify(self.transform_product_list(rows))
+        return response, 200
+
+    def stream_products(self, after_id: int | None, limit: int | None, fmt: str):
+        """
+        Stream products ordered by id from a server-side cursor, STREAM_BATCH_SIZE rows at a time.
+
+        The first batch is fetched and validated before the response starts, so an empty catalog or
+        invalid first batch is still reported with an error status. Later batches are validated as
+        they are streamed.
+
+        Args:
+            after_id (int or None): Only stream products with an id greater than this value.
+            limit (int or None): Maximum number of products to stream, unbounded if None.
+            fmt (str): "json" to stream a JSON array in chunks, "ndjson" for newline-delimited JSON.
+        """
+        query = self.product_rows_query()
+        if after_id is not None:
+            query = query.where(self.Product.id > after_id)
+        if limit is not None:
+            query = query.limit(limit)
+        result = self.db.session.connection().execute(query.execution_options(yield_per=self.STREAM_BATCH_SIZE))
+        partitions = result.partitions()
+        first = next(partitions, [])
+        if first or after_id is None:
+            self.validate_product_list(first)
+        dumps = current_app.json.dumps
+
+        def generate():
+            if fmt == "json":
+                yield "["
+            separator = ""
+            for partition in chain([first], partitions):
+                if not partition:
+                    continue
+                self.validate_product_list(partition)
+                rows = self.transform_product_list(partition)
+                if fmt == "ndjson":
+                    yield "".join(f"{dumps(row)}\n" for row in rows)
+                else:
+                    yield separator + ",".join(dumps(row) for row in rows)
+                    separator = ","
+            if fmt == "json":
+                yield "]"
+
+        return Response(stream_with_context(generate()), mimetype=self.STREAM_MIMETYPES[fmt]), 200
+
+    def validate_list_params(self, after_id, limit, stream) -> tuple:
+        """
+        Validate and normalize the query parameters of GET /products.
+
+        Raises:
+            TypeError: If 'after_id' or 'limit' is not a non-negative integer.
+                    - "'after_id' must be a non-negative integer."
+                    - "'limit' must be a non-negative integer."
+            ValueError: If 'after_id' or 'limit' is out of range or 'stream' is not a supported format.
+                    - "'after_id' must be at most <MAX_QUERY_INT>."
+                    - "'limit' must be between 1 and <MAX_PAGE_SIZE>."
+                    - "'stream' must be one of: json, ndjson."
+
+        Args:
+            after_id (str or int or None): The keyset cursor.
+            limit (str or int or None): The page size.
+            stream (str or None): The streaming format.
+
+        Returns:
+            tuple: The normalized (after_id, limit, stream) values, with absent parameters as None.
+        """
+        after_id = self.parse_query_int("after_id", after_id)
+        limit = self.parse_query_int("limit", limit)
+        if limit is not None and not 1 <= limit <= self.MAX_PAGE_SIZE:
+            raise ValueError(f"'limit' must be between 1 and {self.MAX_PAGE_SIZE}.")
+        if stream is not None and stream not in self.STREAM_MIMETYPES:
+            raise ValueError(f"'stream' must be one of: {', '.join(self.STREAM_MIMETYPES)}.")
+        return after_id, limit, stream
+
+    def validate_search_params(self, name, q, min_price, max_price, sort, after_id, stream) -> dict | None:
+        """
+        Validate and normalize the search parameters of GET /products.
+
+        Raises:
+            ValueError: If a search parameter is invalid, or combined with 'after_id' or 'stream'.
+                    - "Search parameters cannot be combined with 'after_id' or 'stream'."
+                    - "'name' must not be empty."
+                    - "'q' must include at least one word."
+                    - "'sort' must be one of: id, name, price, optionally prefixed with '-'."
+                    - "'min_price' must not be greater than 'max_price'."
+            TypeError: If 'min_price' or 'max_price' is not an amount.
+            ValueError: If 'min_price' or 'max_price' is greater than MAX_PRICE.
+
+        Returns:
+            dict or None: The search, with prices in cents and 'q' as an FTS5 query, or None without search parameters.
+        """
+        if name is None and q is None and min_price is None and max_price is None and sort is None:
+            return None
+        if after_id is not None or stream is not None:
+            raise ValueError("Search parameters cannot be combined with 'after_id' or 'stream'.")
+        search = {}
+        if name is not None:
+            if name == "":
+                raise ValueError("'name' must not be empty.")
+            search["name"] = name
+        if q is not None:
+            # Only the words are kept, quoted so FTS5 operators in the input are matched as plain text
+            words = re.findall(r"[^\W_]+", q)
+            if not words:
+                raise ValueError("'q' must include at least one word.")
+            search["q"] = " ".join(f'"{word}"' for word in words) + "*"
+        for key, value in (("min_price", min_price), ("max_price", max_price)):
+            if value is not None:
+                search[key] = self.parse_query_price(key, value)
+        if "min_price" in search and "max_price" in search and search["min_price"] > search["max_price"]:
+            raise ValueError("'min_price' must not be greater than 'max_price'.")
+        if sort is not None:
+            if sort.lstrip("-") not in self.SORT_FIELDS or sort.startswith("--"):
+                raise ValueError(f"'sort' must be one of: {', '.join(self.SORT_FIELDS)}, optionally prefixed with '-'.")
+            search["sort"] = sort
+        return search
+
+    def parse_query_price(self, name: str, value) -> int:
+        """
+        Parse a non-negative dollar amount query parameter with at most 2 decimal places, into cents.
+
+        Raises:
+            TypeError: If the value is not such an amount.
+            ValueError: If the amount is greater than MAX_PRICE, the highest price a product can have.
+        """
+        if type(value) is str and re.fullmatch(r"\d+(\.\d{1,2})?", value):
+            amount = float(value)
+            if amount > MAX_PRICE:
+                raise ValueError(f"'{name}' must be at most {MAX_PRICE}.")
+            return to_cents(amount)
+        raise TypeError(f"'{name}' must be a non-negative amount with at most 2 decimal places.")
+
+    def parse_query_int(self, name: str, value) -> int | None:
+        """
+        Parse a non-negative integer query parameter, passed either as a query string value or an int.
+
+        Raises:
+            TypeError: If the value is not a non-negative integer.
+            ValueError: If the value is greater than MAX_QUERY_INT.
+        """
+        if value is None:
+            return None
+        if type(value) is str and value.isdigit():
+            value = int(value)
+        elif type(value) is not int or value < 0:
+            raise TypeError(f"'{name}' must be a non-negative integer.")
+        if value > self.MAX_QUERY_INT:
+            raise ValueError(f"'{name}' must be at most {self.MAX_QUERY_INT}.")
+        return value
+
     def transform_product_list(self, products: list) -> list[dict]:
         """
-        Transform the list of Product instances into a list of dictionaries.
+        Transform the list of (id, name, price_cents) product rows into a list of dictionaries,
+        with the price converted to dollars.
 
         Args:
-            products (list[Product]): The list of Product instances to be transformed.
+            products (list[Row]): The (id, name, price_cents) rows to be transformed.
 
         Returns:
             list[dict]: A list of dictionaries representing the products.
@@ -45,42 +602,43 @@ class ProductService:
                             {"id": 3, "name": "Mixing Bowl", "price": 20}
                         ]
         """
-        return [{"id": p.id, "name": p.name, "price": p.price} for p in products]
+        return [{"id": product_id, "name": name, "price": from_cents(price_cents)} for product_id, name, price_cents in products]
 
 
     def validate_product_list(self, products: list) -> None:
         """
-        Validate the list of products.
+        Validate the list of product rows in a single pass.
 
-        Ensures that the provided list is not empty, contains only Product instances, 
-        and that each Product instance has valid 'id', 'name', and 'price' fields 
-        with the correct data types.
+        Ensures that the provided list is not empty, and that each (id, name, price_cents) row has
+        valid 'id', 'name', and 'price_cents' fields with the correct data types.
 
         Raises:
-            ValueError: If the list is empty or if any Product instance is missing required fields.
+            ValueError: If the list is empty or if any row is missing required fields.
                     - Empty list: "No products found."
                     - Missing fields: "Product must contain: id, name, and price fields."
-            TypeError: If any Product instance is not of type Product or has fields with incorrect types.
-                    - Non-Product instance: "One or more of the returned products are not of type <Product>."
+            TypeError: If any row is not an (id, name, price_cents) row or has fields with incorrect types.
+                    - Malformed row: "One or more of the returned products are not (id, name, price_cents) rows."
                     - Incorrect 'id' type: "Product id must be of type int."
                     - Incorrect 'name' type: "Product name must be of type 'str'."
-                    - Incorrect 'price' type: "Product price must be of type 'float'."
+                    - Incorrect 'price_cents' type: "Product price must be an int number of cents."
 
         Args:
-            products (list[Product]): The list of Product instances to be validated.
+            products (list[Row]): The (id, name, price_cents) rows to be validated.
         """
         if not products:
             raise ValueError("No products found.")
-        if not all(type(p) is self.Product for p in products):
-            raise TypeError("One or more of the returned products are not of type <Product>.")
-        if not all(p.id and p.name and p.price for p in products):
-            raise ValueError("Product must contain: id, name, and price fields.")
-        if not all(type(p.id) is int for p in products):
-            raise TypeError("Product id must be of type int.")
-        if not all(type(p.name) is str for p in products):
-            raise TypeError("Product name must be of type 'str'.")
-        if not all(type(p.price) is float for p in products):
-            raise TypeError("Product price must be of type 'float'.")
+        for product in products:
+            if len(product) != 3:
+                raise TypeError("One or more of the returned products are not (id, name, price_cents) rows.")
+            product_id, name, price_cents = product
+            if not (product_id and name and price_cents):
+                raise ValueError("Product must contain: id, name, and price fields.")
+            if type(product_id) is not int:
+                raise TypeError("Product id must be of type int.")
+            if type(name) is not str:
+                raise TypeError("Product name must be of type 'str'.")
+            if type(price_cents) is not int:
+                raise TypeError("Product price must be an int number of cents.")
 
     def create_product(self, data: dict) -> dict:
         """
@@ -97,6 +655,8 @@ class ProductService:
             data (dict): A dictionary containing the product details. Must include:
                         - 'name' (str): The name of the product.
                         - 'price' (float or int): The price of the product.
+                        It may include:
+                        - 'stock' (int): The quantity in stock. Without it, the product's inventory is not tracked.
 
         Returns:
             dict: A dictionary with the new product's details on success.
@@ -105,35 +665,163 @@ class ProductService:
                 Example: ({"error": "Request must include name and price."}, 400)
         """
         try:
-            self.validate_post_request(data)
-            new_product = self.Product(name = data["name"], price=data["price"])
-            self.db.session.add(new_product)
-            self.db.session.commit()
+            with self.metrics.phase("products.validate"):
+                self.validate_post_request(data)
+            new_product = self.Product(name = data["name"], price_cents=to_cents(data["price"]), stock=data.get("stock"))
+            with self.metrics.phase("products.insert"):
+                self.db.session.add(new_product)
+                self.bump_catalog_version()
+                self.db.session.commit()
+            with self.metrics.phase("products.snapshot"):
+                self.refresh_snapshot()
             return jsonify({"id": new_product.id, "name": new_product.name, "price": new_product.price}), 201
         except (ValueError, TypeError) as e:
             return jsonify({"error":str(e)}), 422
 
+    def create_products_bulk(self, records, ndjson: bool = False, chunk_size=None, commit=None):
+        """
+        Create many products at once from a JSON array or a streamed NDJSON body.
+
+        Each record is validated with the same rules as create_product, and valid records are
+        inserted with batched executemany statements of 'chunk_size' rows, so memory stays bounded
+        by one chunk even for a streamed body.
+
+        Two commit modes are supported:
+            - "all" (default): every chunk runs inside one transaction. If any record is invalid,
+              nothing is inserted and every error is reported.
+            - "chunk": each chunk is committed on its own. Invalid records are skipped and reported,
+              and the valid ones are inserted.
+
+        Args:
+            records (Iterable): The product dictionaries, or the raw body lines when 'ndjson' is set.
+            ndjson (bool): Whether 'records' are NDJSON lines that still need to be decoded.
+            chunk_size (str or int, optional): Rows per insert batch, defaults to BULK_CHUNK_SIZE.
+            commit (str, optional): The commit mode, either "all" or "chunk".
+
+        Returns:
+            tuple: On success, a dictionary with the assigned 'ids' in input order and HTTP status code 201.
+                Example: ({"ids": [4, 5]}, 201)
+                In "chunk" mode, rejected records are also listed under 'errors'.
+            tuple: If nothing was inserted because of invalid records, a dictionary with the 'errors'
+                by record index and HTTP status code 422.
+                Example: ({"errors": [{"index": 1, "error": "'price' must be > 0."}]}, 422)
+        """
+        try:
+            chunk_size, commit = self.validate_bulk_params(records, chunk_size, commit, ndjson)
+        except (ValueError, TypeError) as e:
+            return jsonify({"error": str(e)}), 422
+
+        ids, errors, chunk = [], [], []
+        try:
+            index = 0
+            for record in records:
+                if ndjson and not record.strip():
+                    continue
+                try:
+                    data = current_app.json.loads(record) if ndjson else record
+                    if type(data) is not dict:
+                        raise TypeError("Each product must be a JSON object.")
+                    self.validate_post_request(data)
+                    chunk.append({"name": data["name"], "price_cents": to_cents(data["price"]), "stock": data.get("stock")})
+                except (ValueError, TypeError) as e:
+                    errors.append({"index": index, "error": str(e)})
+                index += 1
+                if len(chunk) >= chunk_size:
+                    ids += self.insert_products_chunk(chunk, errors, commit)
+                    chunk = []
+            if chunk:
+                ids += self.insert_products_chunk(chunk, errors, commit)
+
+            if commit == "all" and errors:
+                self.db.session.rollback()
+                return jsonify({"errors": errors}), 422
+            if commit == "all" and ids:
+                self.bump_catalog_version()
+            self.db.session.commit()
+        except Exception:
+            self.db.session.rollback()
+            raise
+        finally:
+            # In "chunk" mode, the chunks committed before a failure are in the catalog too
+            if ids:
+                with self.metrics.phase("products.snapshot"):
+                    self.refresh_snapshot()
+
+        if commit == "chunk":
+            return jsonify({"ids": ids, "errors": errors}), 201 if ids or not errors else 422
+        return jsonify({"ids": ids}), 201
+
+    def insert_products_chunk(self, rows: list[dict], errors: list, commit: str) -> list[int]:
+        """
+        Insert a chunk of validated product rows with a single executemany INSERT ... RETURNING.
+
+        In "all" mode nothing is sent to the db once an error has been seen, since the transaction
+        will be rolled back anyway. In "chunk" mode the catalog version is bumped and the chunk
+        is committed right away.
+
+        Returns:
+            list[int]: The assigned ids, in the same order as 'rows'.
+        """
+        if commit == "all" and errors:
+            return []
+        ids = list(self.db.session.scalars(
+            self.db.insert(self.Product).returning(self.Product.id, sort_by_parameter_order=True),
+            rows,
+        ))
+        if commit == "chunk":
+            self.bump_catalog_version()
+            self.db.session.commit()
+        return ids
+
+    def validate_bulk_params(self, records, chunk_size, commit, ndjson: bool = False) -> tuple:
+        """
+        Validate and normalize the body and query parameters of POST /products/bulk.
+
+        Raises:
+            TypeError: If the body is neither a JSON array nor an NDJSON stream, or 'chunk_size' is not
+                a non-negative integer.
+            ValueError: If 'chunk_size' is out of range or 'commit' is not a supported mode.
+
+        Returns:
+            tuple: The normalized (chunk_size, commit) values.
+        """
+        if records is None or (not ndjson and type(records) is not list):
+            raise TypeError("Request must be a JSON array or NDJSON stream of products.")
+        chunk_size = self.parse_query_int("chunk_size", chunk_size)
+        chunk_size = chunk_size if chunk_size is not None else self.BULK_CHUNK_SIZE
+        if not 1 <= chunk_size <= self.MAX_BULK_CHUNK_SIZE:
+            raise ValueError(f"'chunk_size' must be between 1 and {self.MAX_BULK_CHUNK_SIZE}.")
+        commit = commit if commit is not None else "all"
+        if commit not in self.BULK_COMMIT_MODES:
+            raise ValueError(f"'commit' must be one of: {', '.join(self.BULK_COMMIT_MODES)}.")
+        return chunk_size, commit
+
     def validate_post_request(self, data: dict) -> None:
         """
         Validate the input data for creating a product.
 
-        Ensures that the provided dictionary is not empty and contains both the 'name' and 'price' keys.
-        Additionally, it checks that the 'name' is a string and the 'price' is either an int or a float.
+        Ensures that the provided dictionary is not empty and contains both the 'name' and 'price' keys,
+        and optionally 'stock'. Additionally, it checks that the 'name' is a string, the 'price' is either
+        an int or a float of at most MAX_PRICE, and the 'stock' a non-negative int of at most MAX_STOCK.
         
         Raises:
             ValueError: If the data is empty, missing required keys, or invalid.
                     - Missing keys: "Request must include name and price."
                     - Invalid value: "'price' must be > 0."
+                    - Invalid value: "'price' must be at most <MAX_PRICE>."
+                    - Invalid value: "'stock' must be >= 0."
+                    - Invalid value: "'stock' must be at most <MAX_STOCK>."
             TypeError: If the data values are not of the correct data types.
                     - Incorrect type for 'name': "'name' must be of type string."
                     - Incorrect type for 'price': "'price' must be of type float or int."
+                    - Incorrect type for 'stock': "'stock' must be of type int."
         Args:
             data (dict): The input dictionary to be validated.
         """
         if not data or not ({'name', 'price'} <= data.keys()):
             raise ValueError('Request must include name and price.')
-        if len(data.keys()) > 2:
-            raise ValueError("Request must only include name and price.")
+        if not data.keys() <= {'name', 'price', 'stock'}:
+            raise ValueError("Request must only include name, price and stock.")
         if type(data['name']) is not str:
             raise TypeError("'name' must be of type string.")
         if data["name"] == "":
@@ -142,5 +830,14 @@ class ProductService:
             raise TypeError("'price' must be of type float or int.")
         if data["price"] <= 0:
             raise ValueError("'price' must be > 0.")
+        if data["price"] > MAX_PRICE:
+            raise ValueError(f"'price' must be at most {MAX_PRICE}.")
         if type(data['price']) is float and len(str(data["price"]).split(".")[1]) > 2:
-            raise ValueError("'price' must have at most 2 decimal places.")
\ No newline at end of file
+            raise ValueError("'price' must have at most 2 decimal places.")
+        if "stock" in data:
+            if type(data["stock"]) is not int:
+                raise TypeError("'stock' must be of type int.")
+            if data["stock"] < 0:
+                raise ValueError("'stock' must be >= 0.")
+            if data["stock"] > self.MAX_STOCK:
+                raise ValueError(f"'stock' must be at most {self.MAX_STOCK}.")
\ No newline at end of file
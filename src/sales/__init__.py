@@ -1,2 +1,3 @@
 from .routes import sales_bp
-from .service import SalesService
\ No newline at end of file
+from .service import SalesService, OutOfStockError
+from .ledger import SalesLedger, LedgerFullError, load_ledger_config
@@ -0,0 +1,240 @@
+import atexit
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from flask import has_app_context
+from pricing import to_cents
+
+# Ledger modes, selected with the SALES_LEDGER_MODE environment variable
+LEDGER_MODES = ("write-behind", "durable")
+# Defaults for the SALES_LEDGER_* environment variables
+LEDGER_DEFAULTS = {
+    "mode": "write-behind",
+    "batch_size": 200,  # Max sales group-committed in one transaction
+    "flush_interval_ms": 50,  # Max time a queued sale waits for its batch to fill up
+    "queue_size": 10000,  # Max checkouts (single sales or batches) waiting to be written before new ones are pushed back
+    "put_timeout_ms": 1000,  # How long a checkout waits for room in a full queue before failing
+}
+
+# Marker put on the queue to stop the writer thread once everything before it has been written
+_STOP = object()
+
+class LedgerFullError(Exception):
+    """
+    Raised when sales cannot be queued because the write-behind queue stayed full for put_timeout_ms.
+    """
+
+def load_ledger_config(environ=None) -> dict:
+    """
+    Build the sales ledger configuration from the SALES_LEDGER_* environment variables,
+    e.g. SALES_LEDGER_MODE=durable or SALES_LEDGER_BATCH_SIZE=500.
+
+    Args:
+        environ (dict, optional): The environment to read from, defaults to os.environ.
+    Returns:
+        dict: The keyword arguments for SalesLedger.
+    Raises:
+        ValueError: If the mode is unknown, or a numeric setting is not a positive integer.
+    """
+    environ = os.environ if environ is None else environ
+    config = dict(LEDGER_DEFAULTS)
+    for setting, default in LEDGER_DEFAULTS.items():
+        value = environ.get(f"SALES_LEDGER_{setting.upper()}")
+        if not value:
+            continue
+        if type(default) is int:
+            if not value.isdigit() or int(value) < 1:
+                raise ValueError(f"SALES_LEDGER_{setting.upper()} must be a positive integer.")
+            value = int(value)
+        config[setting] = value
+    if config["mode"] not in LEDGER_MODES:
+        raise ValueError(f"SALES_LEDGER_MODE must be one of: {', '.join(LEDGER_MODES)}.")
+    return config
+
+class SalesLedger:
+    """
+    Records completed sales into the Sale and SaleLineItem tables.
+
+    In "write-behind" mode (the default), record() only puts the sale on a bounded in-process queue (record_many()
+    puts all of its sales as one item, so they are queued or rejected together), and
+    a background writer thread group-commits queued sales in batches of up to batch_size, or whatever
+    arrived within flush_interval_ms, so checkout latency never includes a disk flush. When a batch fails
+    to write, its checkouts are retried one transaction each, so only the ones that cannot be written are lost.
+    When the queue is full, record() blocks for up to put_timeout_ms and then raises LedgerFullError.
+    The queue is flushed when the process exits normally, but a crash loses every sale not yet committed:
+    typically about one flush interval's worth, and at most queue_size checkouts plus the batch being
+    written when the writer falls behind.
+
+    In "durable" mode, record() writes and commits the sale before returning, so no acknowledged sale is lost.
+    """
+
+    def __init__(self, app, db, sale_model, line_item_model, mode: str = "write-behind", batch_size: int = 200,
+                 flush_interval_ms: int = 50, queue_size: int = 10000, put_timeout_ms: int = 1000):
+        self.app = app
+        self.db = db
+        self.Sale = sale_model
+        self.SaleLineItem = line_item_model
+        self.mode = mode
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.put_timeout = put_timeout_ms / 1000
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.writer = None
+        # Pid that started the writer, so a forked worker starts its own thread instead of relying on the parent's
+        self.writer_pid = None
+
+    def record(self, sale: dict, discount: int) -> None:
+        """
+        Record a processed sale in the ledger.
+
+        Args:
+            sale (dict): The processed sale, with its "line_items" and "total_sale_price".
+            discount (int): The flat discount requested for the sale.
+        Raises:
+            LedgerFullError: If the write-behind queue stays full for put_timeout_ms.
+        """
+        self.record_many([(sale, discount)])
+
+    def record_many(self, sales: list[tuple]) -> None:
+        """
+        Record many processed sales in the ledger, all or none of them. In durable mode they are written in
+        one transaction, and in write-behind mode they are queued as a single item.
+
+        Args:
+            sales (list[tuple]): The (sale, discount) of every processed sale.
+        Raises:
+            LedgerFullError: If the write-behind queue stays full for put_timeout_ms.
+        """
+        if not sales:
+            return
+        created_at = datetime.now(timezone.utc)
+        entries = [(sale, discount, created_at) for sale, discount in sales]
+        if self.mode == "durable":
+            self.write_batch(entries)
+            return
+        self.start()
+        try:
+            self.queue.put(entries, timeout=self.put_timeout)
+        except queue.Full:
+            raise LedgerFullError("Sales ledger is busy, try again later.") from None
+
+    def start(self) -> None:
+        """
+        Start the background writer thread, if it is not already running in this process.
+        """
+        if self.writer_pid == os.getpid():
+            return
+        with self.lock:
+            if self.writer_pid == os.getpid():
+                return
+            self.writer = threading.Thread(target=self.run, name="sales-ledger-writer", daemon=True)
+            self.writer.start()
+            self.writer_pid = os.getpid()
+            atexit.register(self.close)
+
+    def flush(self) -> None:
+        """
+        Block until every sale queued so far has been written.
+        """
+        if self.writer_pid == os.getpid():
+            self.queue.join()
+
+    def close(self) -> None:
+        """
+        Write every queued sale and stop the writer thread.
+        """
+        if self.writer_pid != os.getpid() or not self.writer.is_alive():
+            return
+        self.queue.put(_STOP)
+        self.writer.join()
+        self.writer_pid = None
+
+    def run(self) -> None:
+        """
+        Writer thread loop, group-committing queued sales by batch size or flush interval.
+        """
+        stopping = False
+        while not stopping:
+            entries = self.queue.get()
+            if entries is _STOP:
+                self.queue.task_done()
+                break
+            items = [entries]
+            deadline = time.monotonic() + self.flush_interval
+            size = len(entries)
+            while size < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    entries = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if entries is _STOP:
+                    self.queue.task_done()
+                    stopping = True
+                    break
+                items.append(entries)
+                size += len(entries)
+            try:
+                self.write_batch([entry for entries in items for entry in entries])
+            except Exception:
+                if len(items) == 1:
+                    self.app.logger.exception("Failed to write %d sales to the ledger.", size)
+                else:
+                    self.write_items(items)
+            finally:
+                for _ in items:
+                    self.queue.task_done()
+
+    def write_items(self, items: list[list]) -> None:
+        """
+        Write the queued checkouts of a failed batch one transaction each, so a sale that cannot be
+        written only loses its own checkout, instead of every sale group-committed with it.
+
+        Args:
+            items (list[list]): The (sale, discount, created_at) entries of each queued checkout.
+        """
+        for entries in items:
+            try:
+                self.write_batch(entries)
+            except Exception:
+                self.app.logger.exception("Failed to write %d sales to the ledger.", len(entries))
+
+    def write_batch(self, batch: list[tuple]) -> None:
+        """
+        Insert a batch of sales and their line items in a single transaction, on the app's session
+        like every other write. Durable writes reuse the session of the current request, and the writer
+        thread pushes an app context of its own.
+
+        Args:
+            batch (list[tuple]): The (sale, discount, created_at) entries to write.
+        """
+        if not has_app_context():
+            with self.app.app_context():
+                return self.write_batch(batch)
+        sale_rows = [
+            {"total_sale_price_cents": to_cents(sale["total_sale_price"]), "discount": discount, "created_at": created_at}
+            for sale, discount, created_at in batch
+        ]
+        session = self.db.session
+        sale_ids = session.scalars(
+            self.db.insert(self.Sale).returning(self.Sale.id, sort_by_parameter_order=True),
+            sale_rows,
+        ).all()
+        line_item_rows = [
+            {
+                "sale_id": sale_id,
+                "product_id": item["id"],
+                "quantity": item["quantity"],
+                "price_cents": to_cents(item["price"]),
+                "discount_cents": to_cents(item["discount"]),
+            }
+            for sale_id, (sale, _, _) in zip(sale_ids, batch)
+            for item in sale["line_items"]
+        ]
+        session.execute(self.db.insert(self.SaleLineItem), line_item_rows)
+        session.commit()
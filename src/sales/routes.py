@@ -7,4 +7,11 @@ def make_sale():
     """
     POST /sales processes sale of line-items included in request.
     """
-    return current_app.sales_service.process_sale(request.get_json())
\ No newline at end of file
+    return current_app.sales_service.process_sale(request.get_json())
+
+@sales_bp.post("/batch")
+def make_sales_batch():
+    """
+    POST /sales/batch processes many sales in one request, returning a result or an error for each of them.
+    """
+    return current_app.sales_service.process_sales_batch(request.get_json())
\ No newline at end of file
@@ -1,14 +1,35 @@
 from flask import jsonify
+from pricing import MAX_DISCOUNT, MAX_LINE_ITEMS, MAX_QUANTITY, from_cents, price_cart, price_carts
+from .ledger import LedgerFullError
+
+class OutOfStockError(Exception):
+    """
+    Raised when a sale cannot reserve the stock of all its line items, listing the short ones.
+    """
+    def __init__(self, short: list[dict]):
+        super().__init__("Insufficient stock.")
+        self.short = short
+
 class SalesService:
+    # Max number of product ids bound into a single IN (...) lookup, keeps large carts under SQLite's variable limit
+    LOOKUP_CHUNK_SIZE = 500
+    # Max number of sales accepted by one POST /sales/batch request
+    MAX_BATCH_SIZE = 10000
 
-    def __init__(self, db, product_model):
+    def __init__(self, db, product_model, ledger, metrics, catalog_snapshot=None):
         self.db = db
         self.Product = product_model
+        self.ledger = ledger
+        self.metrics = metrics
+        # Memory-mapped catalog shared by the worker processes, resolving products before the db is queried
+        self.catalog_snapshot = catalog_snapshot
 
     def process_sale(self, data: dict) -> dict:
         """
-        Process a sale by validating the request, processing each line item,
-        applying a discount, and calculating the total sale price.
+        Process a sale by validating the request, resolving every product in the cart
+        with batched lookups, processing each line item, applying a discount,
+        calculating the total sale price, reserving the stock of the line items,
+        and recording the sale in the ledger.
         
         Args:
             data (dict): A dictionary containing the sale request. It must include:
@@ -20,76 +41,385 @@ class SalesService:
                 - "total_sale_price": The sum of the prices for all line items after discount.
         Raises:
             ValueError or TypeError: If the sales request is invalid.
+            OutOfStockError: If a product is short, returned as a 409 listing the short products.
+            LedgerFullError: If the sales ledger cannot accept the sale, returned as a 503.
         """
         try:
-            self.valid_sales_request(data)
-            processed_line_items = [self.process_line_item(item) for item in data.get("line_items")]
-            discount = data.get("discount", 0)
-            processed_line_items = self.apply_discount(processed_line_items, discount)
-            return jsonify({
-                "line_items": processed_line_items,
-                "total_sale_price": sum(item["price"] for item in processed_line_items)
-            }), 200
+            with self.metrics.phase("sales.validate"):
+                line_items = self.validate_sale(data)
+            with self.metrics.phase("sales.lookup"):
+                products = self.resolve_products(item["id"] for item in line_items)
+            with self.metrics.phase("sales.pricing"):
+                sale = self.price_sale(line_items, data["discount"], products)
+            self.complete_sale(sale, data["discount"], self.stock_quantities(line_items, products))
+            with self.metrics.phase("sales.serialize"):
+                return jsonify(sale), 200
         except (ValueError, TypeError) as e:
             return jsonify({"error": str(e)}), 422
+        except OutOfStockError as e:
+            return jsonify({"error": str(e), "short": e.short}), 409
+        except LedgerFullError as e:
+            return jsonify({"error": str(e)}), 503
 
-    def apply_discount(self, line_items: list[dict], total_discount: int) -> list[dict]:
+    def complete_sale(self, sale: dict, discount: int, quantities: dict) -> None:
         """
-        Distribute a flat discount evenly across all line items. The discount is
-        spread proportionally by item count, with any rounding differences adjusted
-        in the last item.
-        
+        Reserve the stock of a priced sale and record it in the ledger.
+
         Args:
-            line_items (list): A list of dictionaries, each representing a line item.
-                Each line item contains an id, quantity and price.
-            total_discount (int or float): The total discount amount to be applied.
-        Returns:
-            list: The list of line items updated with a new key "discount" indicating
-                the discount amount applied to each item.
-        """
-        accumulated_discount = 0
-        num_items = len(line_items)
-        for i in range(num_items):
-            if i < num_items-1:
-                item_discount = round((total_discount/num_items), 2)
-                accumulated_discount += item_discount
+            sale (dict): The priced sale.
+            discount (int): The flat discount requested for the sale.
+            quantities (dict[int, int]): The quantities to reserve, as returned by stock_quantities.
+        Raises:
+            OutOfStockError: If a product is short, after rolling back.
+            LedgerFullError: If the sales ledger cannot accept the sale, after releasing the stock.
+        """
+        try:
+            with self.metrics.phase("sales.reserve"):
+                self.end_lookup(quantities)
+                self.reserve_stock(quantities)
+        except OutOfStockError:
+            self.db.session.rollback()
+            raise
+        with self.metrics.phase("sales.ledger"):
+            self.record_sales([(sale, discount)], [quantities])
+
+    def stock_quantities(self, line_items: list[dict], products: dict) -> dict[int, int]:
+        """
+        Sum the quantities of a sale's line items by product, for the products whose stock is tracked.
+        """
+        quantities = {}
+        for item in line_items:
+            if products[item["id"]].tracked:
+                quantities[item["id"]] = quantities.get(item["id"], 0) + item["quantity"]
+        return quantities
+
+    def end_lookup(self, *quantities: dict) -> None:
+        """
+        End the read transaction of the product lookup before reserving stock, so the reservation starts
+        a transaction with its write. SQLite cannot upgrade a read transaction to a write one once another
+        checkout has committed since it began, failing with SQLITE_BUSY instead of waiting its turn.
+        """
+        if any(quantities):
+            self.db.session.rollback()
+
+    def reserve_stock(self, quantities: dict) -> None:
+        """
+        Reserve stock for a sale, for all of its products or none of them, without reading it first.
+
+        Each chunk of LOOKUP_CHUNK_SIZE products is reserved by a single conditional
+        UPDATE ... SET stock = stock - q WHERE id IN (...) AND stock >= q RETURNING id,
+        so the check and the decrement are atomic, and concurrent checkouts cannot oversell
+        without any lock held across the request. When a product is short, the products
+        already reserved are released, and the short ones reported with their available stock.
+        The reservation is left uncommitted, for record_sales.
+
+        Args:
+            quantities (dict[int, int]): The quantities to reserve, by product ID.
+        Raises:
+            OutOfStockError: If any of the products does not have enough stock.
+        """
+        if not quantities:
+            return
+        connection = self.db.session.connection()
+        reserved = []
+        for query in self.reservation_queries(quantities):
+            reserved += connection.execute(query).scalars().all()
+        if len(reserved) == len(quantities):
+            return
+        reserved = set(reserved)
+        for query in self.reservation_queries({pid: quantities[pid] for pid in reserved}, release=True):
+            connection.execute(query)
+        short = [product_id for product_id in quantities if product_id not in reserved]
+        available = dict(connection.execute(
+            self.db.select(self.Product.id, self.Product.stock).where(self.Product.id.in_(short))
+        ).all())
+        raise OutOfStockError([
+            {"id": product_id, "requested": quantities[product_id], "available": available.get(product_id)}
+            for product_id in short
+        ])
+
+    def reservation_queries(self, quantities: dict, release: bool = False):
+        """
+        Build one conditional UPDATE per LOOKUP_CHUNK_SIZE products, decrementing their stock by the given
+        quantities where enough is left and returning the reserved IDs, or incrementing it back with 'release'.
+        """
+        product_ids = list(quantities)
+        for start in range(0, len(product_ids), self.LOOKUP_CHUNK_SIZE):
+            chunk = {product_id: quantities[product_id] for product_id in product_ids[start:start + self.LOOKUP_CHUNK_SIZE]}
+            quantity = self.db.case(chunk, value=self.Product.id)
+            query = self.db.update(self.Product).where(self.Product.id.in_(list(chunk)))
+            if release:
+                yield query.values(stock=self.Product.stock + quantity)
             else:
-                item_discount = round(total_discount - accumulated_discount, 2)
-            line_items[i]["discount"] = item_discount
-        return line_items
+                yield (
+                    query.where(self.Product.stock >= quantity)
+                    .values(stock=self.Product.stock - quantity)
+                    .returning(self.Product.id)
+                )
 
-    def process_line_item(self, item: dict) -> dict:
+    def record_sales(self, sales: list[tuple], reserved: list[dict]) -> None:
         """
-        Process a single line item by validating the input, looking up the product,
-        and calculating the total price for the given quantity.
-        
+        Commit the stock reserved for processed sales, and record them in the ledger.
+
+        The durable ledger writes the sales on the request's session, so they are committed in the same
+        transaction as their stock. Otherwise the stock is committed first, and released again if the
+        write-behind queue cannot take the sales.
+
         Args:
-            item (dict): A dictionary with the keys "id" (product ID) and "quantity".
+            sales (list[tuple]): The (sale, discount) of every processed sale.
+            reserved (list[dict]): The quantities reserved for each sale, by product ID.
+        Raises:
+            LedgerFullError: If the sales ledger cannot accept the sales.
+        """
+        if self.ledger.mode == "durable":
+            self.ledger.record_many(sales)
+            return
+        if any(reserved):
+            self.db.session.commit()
+        try:
+            self.ledger.record_many(sales)
+        except LedgerFullError:
+            if any(reserved):
+                connection = self.db.session.connection()
+                for quantities in reserved:
+                    for query in self.reservation_queries(quantities, release=True):
+                        connection.execute(query)
+                self.db.session.commit()
+            raise
+
+    def process_sales_batch(self, data: list) -> dict:
+        """
+        Process many sales in one request. Each sale is validated like in process_sale, the product IDs
+        of all the valid carts are deduplicated into one catalog fetch, and the carts are priced together.
+        The stock of each sale is reserved on its own, and the sales are recorded together.
+
+        An invalid or short sale does not fail the batch: its entry in the results holds its error instead.
+
+        Args:
+            data (list): A list of sale requests, each like the body of POST /sales.
+        Returns:
+            dict: A dictionary containing:
+                - "results": For each sale, in order, either the processed sale or {"error": "..."}.
+        Raises:
+            ValueError or TypeError: If the batch itself is invalid, returned as a 422.
+            LedgerFullError: If the sales ledger cannot accept the sales, returned as a 503.
+        """
+        try:
+            self.valid_batch_request(data)
+        except (ValueError, TypeError) as e:
+            return jsonify({"error": str(e)}), 422
+        try:
+            with self.metrics.phase("sales.validate"):
+                results, carts = self.validate_batch(data)
+            with self.metrics.phase("sales.lookup"):
+                products = self.fetch_products(self.batch_product_ids(carts))
+            return self.finish_batch(results, carts, products)
+        except LedgerFullError as e:
+            return jsonify({"error": str(e)}), 503
+
+    def validate_batch(self, data: list) -> tuple[list, list]:
+        """
+        Validate every sale of a batch.
+
+        Returns:
+            tuple[list, list]: The results, holding {"error": "..."} for invalid sales and None for the others,
+                and the (index, line_items, discount) of every valid cart.
+        """
+        results = [None] * len(data)
+        carts = []
+        for index, sale in enumerate(data):
+            try:
+                carts.append((index, self.validate_sale(sale), sale["discount"]))
+            except (ValueError, TypeError) as e:
+                results[index] = {"error": str(e)}
+        return results, carts
+
+    def batch_product_ids(self, carts: list) -> list[int]:
+        """
+        Deduplicate the product IDs referenced by all the carts of a batch.
+        """
+        return list(dict.fromkeys(item["id"] for _, line_items, _ in carts for item in line_items))
+
+    def finish_batch(self, results: list, carts: list, products: dict):
+        """
+        Price the valid carts of a batch against the fetched products, reserve their stock, record them
+        in the ledger, and build the response. Carts referencing unknown products, or short of stock,
+        get their error in the results.
+        """
+        with self.metrics.phase("sales.pricing"):
+            priceable = []
+            for index, line_items, discount in carts:
+                try:
+                    self.check_resolved(list(dict.fromkeys(item["id"] for item in line_items)), products)
+                    priceable.append((index, line_items, discount))
+                except ValueError as e:
+                    results[index] = {"error": str(e)}
+            prices = {product_id: product.price_cents for product_id, product in products.items()}
+            sales = price_carts([(line_items, discount) for _, line_items, discount in priceable], prices)
+        with self.metrics.phase("sales.reserve"):
+            cart_quantities = [self.stock_quantities(line_items, products) for _, line_items, _ in priceable]
+            self.end_lookup(*cart_quantities)
+            recorded, reserved = [], []
+            for (index, _, discount), sale, quantities in zip(priceable, sales, cart_quantities):
+                try:
+                    self.reserve_stock(quantities)
+                except OutOfStockError as e:
+                    results[index] = {"error": str(e), "short": e.short}
+                    continue
+                results[index] = sale
+                recorded.append((sale, discount))
+                reserved.append(quantities)
+        with self.metrics.phase("sales.ledger"):
+            self.record_sales(recorded, reserved)
+        with self.metrics.phase("sales.serialize"):
+            return jsonify({"results": results}), 200
+
+    def valid_batch_request(self, data: list) -> None:
+        """
+        Validate the body of a batch sales request.
+
+        Raises:
+            TypeError: If the body is not a list.
+            ValueError: If the list is empty or holds more than MAX_BATCH_SIZE sales.
+        """
+        if type(data) is not list:
+            raise TypeError("Request must be a JSON array of sales.")
+        if not data:
+            raise ValueError("Request must include at least one sale.")
+        if len(data) > self.MAX_BATCH_SIZE:
+            raise ValueError(f"Request must include at most {self.MAX_BATCH_SIZE} sales.")
+
+    def validate_sale(self, data: dict) -> list[dict]:
+        """
+        Validate a sales request and each of its line items.
+
+        Args:
+            data (dict): The sales request data.
         Returns:
-            dict: A dictionary representing the processed line item, including:
-                - "id": The product ID.
-                - "quantity": The quantity purchased.
-                - "price": The total price calculated as quantity * product price.
+            list[dict]: The validated line items.
         Raises:
-            TypeError: If the product ID or quantity is not an integer.
-            ValueError: If the quantity is not positive or the product is not found.
+            ValueError or TypeError: If the sales request or one of its line items is invalid.
         """
-        product_id = item.get("id")
-        quantity = item.get("quantity")
+        self.valid_sales_request(data)
+        line_items = data["line_items"]
+        for item in line_items:
+            self.validate_line_item(item)
+        return line_items
+
+    def price_sale(self, line_items: list[dict], discount: int, products: dict) -> dict:
+        """
+        Price validated line items against the resolved products and apply the flat discount.
+
+        Every amount is calculated in integer cents by the pricing engine, so totals are exact,
+        and only converted back to dollars for the response. Each line item's "price" is its
+        quantity * unit price, and the flat discount is split evenly across the line items,
+        with the rounding difference adjusted in the last one.
 
-        if type(product_id) is not int or type(quantity) is not int:
+        Args:
+            line_items (list[dict]): The validated line items, each with "id" and "quantity".
+            discount (int): The flat discount for the sale.
+            products (dict[int, Row]): Resolved products keyed by ID, as returned by resolve_products.
+        Returns:
+            dict: The sale, with its processed "line_items" and "total_sale_price".
+        """
+        return price_cart(line_items, discount, {product_id: product.price_cents for product_id, product in products.items()})
+
+    def validate_line_item(self, item: dict) -> None:
+        """
+        Validate a single line item of a sales request.
+
+        Args:
+            item (dict): A dictionary with the keys "id" (product ID) and "quantity".
+        Raises:
+            TypeError: If the line item is not an object, or the product ID or quantity is not an integer.
+            ValueError: If the quantity is not between 1 and MAX_QUANTITY.
+        """
+        if type(item) is not dict:
+            raise TypeError("Each line item must be an object with id and quantity.")
+        if type(item.get("id")) is not int or type(item.get("quantity")) is not int:
             raise TypeError("A product's ID and quantity must be integers.")
-        if quantity <= 0:
+        if item["quantity"] <= 0:
             raise ValueError("Each product must have a positive purchase quantity.")
-        
-        product = self.product_lookup(product_id)
-        item_total = item["quantity"]*product["price"]
-        
-        return {
-            "id": product_id, 
-            "quantity": quantity, 
-            "price": item_total
-            }
+        if item["quantity"] > MAX_QUANTITY:
+            raise ValueError(f"A purchase quantity must be at most {MAX_QUANTITY}.")
+
+    def resolve_products(self, product_ids) -> dict:
+        """
+        Resolve all products referenced by a sale in as few queries as possible.
+
+        The IDs are deduplicated and looked up in the catalog snapshot shared by the worker processes.
+        The ones it does not have, or all of them without a snapshot, are fetched with one IN (...) query
+        per LOOKUP_CHUNK_SIZE IDs, so a cart costs a constant number of round trips rather than one per
+        line item. The statements run with SQLAlchemy Core on the session's connection and the compact
+        rows are kept as-is, without building ORM instances.
+
+        Args:
+            product_ids (Iterable[int]): The product IDs referenced by the sale, duplicates allowed.
+        Returns:
+            dict[int, Row]: The (id, name, price_cents, tracked) rows, keyed by product ID.
+        Raises:
+            ValueError: If any of the IDs is not found, listing every missing ID.
+        """
+        unique_ids = list(dict.fromkeys(product_ids))
+        return self.check_resolved(unique_ids, self.fetch_products(unique_ids))
+
+    def fetch_products(self, unique_ids: list[int]) -> dict:
+        """
+        Fetch the (id, name, price_cents, tracked) rows of the given products, keyed by product ID,
+        from the catalog snapshot and then the db. Unknown IDs are left out of the result.
+        """
+        products, missing = self.snapshot_products(unique_ids)
+        if missing:
+            connection = self.db.session.connection()
+            for query in self.lookup_queries(missing):
+                products.update((row.id, row) for row in connection.execute(query))
+        return products
+
+    def snapshot_products(self, unique_ids: list[int]) -> tuple[dict, list[int]]:
+        """
+        Look up products in the catalog snapshot, returning the entries found keyed by product ID,
+        and the IDs left to fetch from the db, such as products created since the snapshot was swapped in.
+        """
+        view = self.catalog_snapshot.view() if self.catalog_snapshot is not None else None
+        if view is None:
+            return {}, unique_ids
+        products, missing = {}, []
+        for product_id in unique_ids:
+            entry = view.get(product_id)
+            if entry is None:
+                missing.append(product_id)
+            else:
+                products[product_id] = entry
+        return products, missing
+
+    def lookup_queries(self, unique_ids: list[int]):
+        """
+        Build one IN (...) statement per LOOKUP_CHUNK_SIZE product IDs, selecting their id, name, price_cents,
+        and whether their stock is tracked. The stock itself is only read by the reservation's conditional UPDATE.
+        """
+        for start in range(0, len(unique_ids), self.LOOKUP_CHUNK_SIZE):
+            chunk = unique_ids[start:start + self.LOOKUP_CHUNK_SIZE]
+            yield (
+                self.db.select(
+                    self.Product.id, self.Product.name, self.Product.price_cents,
+                    self.Product.stock.is_not(None).label("tracked"),
+                )
+                .where(self.Product.id.in_(chunk))
+            )
+
+    def check_resolved(self, unique_ids: list[int], products: dict) -> dict:
+        """
+        Ensure every requested product ID was resolved.
+
+        Raises:
+            ValueError: If any of the IDs is not found, listing every missing ID.
+        """
+        missing = [product_id for product_id in unique_ids if product_id not in products]
+        if len(missing) == 1:
+            raise ValueError(f"Product with id {missing[0]} not found.")
+        if missing:
+            raise ValueError(f"Products with ids {', '.join(map(str, missing))} not found.")
+        return products
 
     def product_lookup(self, product_id: int) -> dict:
         """
@@ -102,10 +432,8 @@ class SalesService:
         Raises:
             ValueError: If no product with the given ID is found.
         """
-        product = self.db.session.get(self.Product, product_id)
-        if not product:
-            raise ValueError(f"Product with id {product_id} not found.")
-        return {"name" : product.name, "price" : product.price}
+        product = self.resolve_products([product_id])[product_id]
+        return {"name": product.name, "price": from_cents(product.price_cents)}
         
     def valid_sales_request(self, data: dict):
         """
@@ -115,9 +443,10 @@ class SalesService:
         Args:
             data (dict): The sales request data which must include:
                 - "line_items": A list of line items.
-                - "discount": An integer representing the discount amount.
+                - "discount": An integer representing the discount amount, between 0 and MAX_DISCOUNT.
         Raises:
-            ValueError: If required fields are missing or if the list of line items is empty.
+            ValueError: If required fields are missing, the discount is out of range, or the list of line items
+                is empty or longer than MAX_LINE_ITEMS.
             TypeError: If "discount" is not an integer or "line_items" is not a list.
         """
         if data is None:
@@ -128,7 +457,11 @@ class SalesService:
             raise ValueError("Missing 'discount' field.")
         if type(data["discount"]) is not int:
             raise TypeError("'discount' must be an int.")
+        if not 0 <= data["discount"] <= MAX_DISCOUNT:
+            raise ValueError(f"'discount' must be between 0 and {MAX_DISCOUNT}.")
         if type(data["line_items"]) is not list:
             raise TypeError("'line_items' must be a list.")
         if len(data["line_items"]) < 1:
-            raise ValueError("Request must include at least one line item.")
\ No newline at end of file
+            raise ValueError("Request must include at least one line item.")
+        if len(data["line_items"]) > MAX_LINE_ITEMS:
+            raise ValueError(f"Request must include at most {MAX_LINE_ITEMS} line items.")
\ No newline at end of file
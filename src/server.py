@@ -1,38 +1,90 @@
 from flask import Flask
 from dotenv import load_dotenv
 import os
-from db import init_db, db, Product
+import weakref
+import click
+from db import init_db, seed_db, load_engine_profile, db, Product, CatalogVersion, Sale, SaleLineItem, product_search
 from products import products_bp, ProductService
-from sales import sales_bp, SalesService
+from sales import sales_bp, SalesService, SalesLedger, load_ledger_config
+from metrics import Metrics, load_metrics_config
+from json_provider import load_json_provider
+from compress import Compressor, load_compression_config
+from snapshot import CatalogSnapshot, load_snapshot_path
 
 class AppFactory:
     # Constructor that initializes the Flask application, connects to the db, initializes services, and registers blueprints
-    def __init__(self, basedir: str = None):
+    # database_uri overrides the 'catalog.db' file in basedir, e.g. "sqlite://" for a shared in-memory db in tests
+    def __init__(self, basedir: str = None, database_uri: str = None):
         # Sets basedir to be the absolute path of the directory containing this file, IF not provided
         basedir = basedir if basedir else os.path.abspath(os.path.dirname(__file__))
         self.app = Flask(__name__)# Instantiate the Flask application
-        self.__connect_db(basedir)# Calls the class function to connect to the db, with the basedir
+        self.app.json = load_json_provider()(self.app)# Install the JSON provider selected by JSON_PROVIDER, used by jsonify and request.get_json
+        self.__connect_db(basedir, database_uri)# Calls the class function to connect to the db, with the basedir
+        self.__init_metrics()# Calls the class function to register the request and SQL instrumentation
+        self.__init_compression()# Calls the class function to register the response compression
         self.__init_services()# Calls the class function to initialize the services
         self.__register_blueprints()# Calls the class function to register the blueprints
+        self.__register_commands()# Calls the class function to register the CLI commands
+        self.__register_fork_hook()# Calls the class function to make the app safe to fork after loading
 
     # Function to connect to the db
-    def __connect_db(self, basedir):
+    def __connect_db(self, basedir, database_uri=None):
         # Configure the db named 'catalog.db' to be stored in the base directory, and avoid SQLAlchemy from tracking modifications.
-        self.app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(basedir, 'catalog.db')}"
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = database_uri or f"sqlite:///{os.path.join(basedir, 'catalog.db')}"
         self.app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-        init_db(self.app)# Initialize the db to be populated with default data
+        # Load the engine profile (PRAGMAs and pool settings) selected by DB_PROFILE and its overrides in the environment
+        self.app.config['SQLITE_PRAGMAS'], self.app.config['SQLALCHEMY_ENGINE_OPTIONS'] = load_engine_profile()
+        init_db(self.app)# Initialize the db schema, skipped when the stored schema version is current
         self.db = db # Store the db instance in the app
+        # Share the catalog between workers through a memory-mapped snapshot next to the db file, or at CATALOG_SNAPSHOT
+        self.app.config['CATALOG_SNAPSHOT'] = load_snapshot_path(None if database_uri else os.path.join(basedir, 'catalog.snapshot'))
+
+    # Function to register the request and SQL instrumentation, configured from the environment, and the /metrics endpoint
+    def __init_metrics(self):
+        self.app.metrics = Metrics(**load_metrics_config())
+        with self.app.app_context():
+            self.app.metrics.init_app(self.app, [db.engine])
+
+    # Function to register the response compression negotiated from Accept-Encoding, configured from the environment
+    # Registered after the metrics, so its after_request hook runs first and the request latency includes the compression
+    def __init_compression(self):
+        self.app.compressor = Compressor(**load_compression_config())
+        self.app.compressor.init_app(self.app)
 
     # Function to initialize the services
     def __init_services(self):
-        self.app.products_service = ProductService(db, Product)# Initialize the products service
-        self.app.sales_service = SalesService(db, Product)# Initialize the sales service
+        self.app.sales_ledger = SalesLedger(self.app, db, Sale, SaleLineItem, **load_ledger_config())# Initialize the sales ledger, configured from the environment
+        snapshot_path = self.app.config['CATALOG_SNAPSHOT']
+        self.app.catalog_snapshot = CatalogSnapshot(snapshot_path) if snapshot_path else None# Initialize the catalog snapshot, None when disabled
+        self.app.products_service = ProductService(db, Product, CatalogVersion, product_search, self.app.metrics, self.app.catalog_snapshot)# Initialize the products service
+        self.app.sales_service = SalesService(db, Product, self.app.sales_ledger, self.app.metrics, self.app.catalog_snapshot)# Initialize the sales service
+        with self.app.app_context():
+            self.app.products_service.refresh_snapshot()# Bring the catalog snapshot up to the db, a no-op when it is current
     
     # Function to register the blueprints
     def __register_blueprints(self):
         self.app.register_blueprint(products_bp)# Register the products blueprint with the application
         self.app.register_blueprint(sales_bp)# Register the sales blueprint with the application
 
+    # Function to register the CLI commands, e.g. `flask seed`
+    def __register_commands(self):
+        @self.app.cli.command("seed")
+        def seed():
+            """Insert the initial catalog if the products table is empty."""
+            click.echo(f"Inserted {seed_db(self.app)} products.")
+
+    # Function to reset, in every forked worker, the state that must not be shared with the parent process,
+    # so the app can be loaded once and forked (e.g. `gunicorn --preload`). Holds the app weakly, so it can still be freed.
+    def __register_fork_hook(self):
+        app = weakref.ref(self.app)
+        os.register_at_fork(after_in_child=lambda: app() is not None and reset_after_fork(app()))
+
+# Function to reset the state a forked worker must not share with its parent
+def reset_after_fork(app):
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)# Drop the parent's pooled connections without closing them under the parent
+
 # Function to create the app using the AppFactory, and return it
 def create_app():
     return AppFactory().app
@@ -0,0 +1,220 @@
+"""
+Read-optimized catalog snapshot, shared by every worker process through a memory-mapped file.
+
+The file holds the products ordered by id, in four sections:
+    - a header with the catalog version it was built at, the number of products and the size of the JSON,
+    - the ID index, the sorted product ids as an array of int64, binary searched by lookups,
+    - one fixed-width record per product, in the same order: id, price_cents, whether the stock is tracked,
+      and the offset and length of the product's JSON object,
+    - the GET /products body, a JSON array of the pre-rendered products.
+
+A page of consecutive products is a single slice of that array, so listings are served without rendering
+anything. Writers build a new file next to the current one and swap it in with os.replace, under an
+exclusive lock on a side file, and readers notice the swap with an os.stat of the path on each request,
+mapping the new file only when it changed. Pages of the mapped file are shared by all the processes.
+"""
+import json
+import mmap
+import os
+import struct
+import tempfile
+from array import array
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:  # fcntl is POSIX only, elsewhere concurrent writers are not serialized across processes
+    fcntl = None
+
+# Magic number and format version, catalog version, number of products, size of the JSON array in bytes
+HEADER = struct.Struct("=8sqqq")
+MAGIC = b"RCATSNP1"
+# id, price_cents, JSON offset, JSON length, stock tracked, padded to 32 bytes
+RECORD = struct.Struct("=qqQIB3x")
+
+
+def load_snapshot_path(default: str | None, environ=None) -> str | None:
+    """
+    Pick the catalog snapshot file from the CATALOG_SNAPSHOT environment variable, a path, or "0" to disable it.
+
+    Args:
+        default (str or None): The path used when the variable is not set, None to disable the snapshot.
+        environ (dict, optional): The environment to read from, defaults to os.environ.
+    Returns:
+        str or None: The snapshot path, or None when the snapshot is disabled.
+    """
+    environ = os.environ if environ is None else environ
+    value = environ.get("CATALOG_SNAPSHOT")
+    if not value:
+        return default
+    return None if value in ("0", "false", "False") else value
+
+
+class CatalogEntry:
+    """
+    A product of the snapshot, with the id, name, price_cents and tracked fields of the sales lookup rows.
+    The name is only decoded from the product's JSON when it is read.
+    """
+    __slots__ = ("id", "price_cents", "tracked", "json")
+
+    def __init__(self, product_id: int, price_cents: int, tracked: bool, json_bytes):
+        self.id = product_id
+        self.price_cents = price_cents
+        self.tracked = tracked
+        self.json = json_bytes
+
+    @property
+    def name(self) -> str:
+        return json.loads(bytes(self.json))["name"]
+
+
+class SnapshotView:
+    """
+    A mapped snapshot file. Views are immutable, a rebuilt snapshot is a new file and a new view.
+    """
+
+    def __init__(self, mm: mmap.mmap, key: tuple):
+        self.key = key
+        magic, self.version, self.count, json_length = HEADER.unpack_from(mm)
+        self.records_offset = HEADER.size + 8 * self.count
+        json_offset = self.records_offset + RECORD.size * self.count
+        if magic != MAGIC or len(mm) != json_offset + json_length:
+            raise ValueError("Catalog snapshot is corrupt or from another format version.")
+        self.mm = mm
+        self.ids = memoryview(mm)[HEADER.size:self.records_offset].cast("q")
+        self.json = memoryview(mm)[json_offset:]
+
+    def record(self, index: int) -> tuple:
+        """
+        Unpack the (id, price_cents, JSON offset, JSON length, tracked) record at 'index'.
+        """
+        return RECORD.unpack_from(self.mm, self.records_offset + RECORD.size * index)
+
+    def get(self, product_id: int) -> CatalogEntry | None:
+        """
+        Find a product by id in the ID index, or None if it is not in the snapshot.
+        """
+        index = bisect_left(self.ids, product_id)
+        if index == self.count or self.ids[index] != product_id:
+            return None
+        _, price_cents, offset, length, tracked = self.record(index)
+        return CatalogEntry(product_id, price_cents, bool(tracked), self.json[offset:offset + length])
+
+    def listing(self) -> bytes:
+        """
+        Return the JSON array of every product, as rendered by GET /products.
+        """
+        return self.json.tobytes() + b"\n"
+
+    def page(self, after_id: int | None, limit: int) -> tuple[bytes, int, int | None]:
+        """
+        Return the JSON array of the first 'limit' products with an id greater than 'after_id', the number
+        of products in it, and the id of the last one, or None for an empty page.
+        """
+        start = 0 if after_id is None else bisect_right(self.ids, after_id)
+        end = min(start + limit, self.count)
+        if start >= end:
+            return b"[]\n", 0, None
+        first_offset = self.record(start)[2]
+        last_id, _, last_offset, last_length, _ = self.record(end - 1)
+        return b"[" + self.json[first_offset:last_offset + last_length].tobytes() + b"]\n", end - start, last_id
+
+
+class CatalogSnapshot:
+    """
+    The catalog snapshot file at 'path', mapped by readers and rebuilt by writers.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.current = None
+
+    def view(self) -> SnapshotView | None:
+        """
+        Return the view of the current snapshot file, mapping it again if it was swapped since the last call.
+        Returns None when there is no usable snapshot, in which case callers read from the db.
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        # A swapped file is a new inode, the mtime and size guard against an inode reused by the filesystem
+        key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        current = self.current
+        if current is not None and current.key == key:
+            return current
+        try:
+            with open(self.path, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            current = SnapshotView(mm, key)
+        except (OSError, ValueError):
+            return None
+        self.current = current
+        return current
+
+    @contextmanager
+    def writing(self, block: bool = True):
+        """
+        Hold the exclusive lock of the snapshot writers, across processes, for a rebuild or an append.
+
+        Args:
+            block (bool): Wait for the lock when another writer holds it. Otherwise, the context yields False
+                right away, and True once the lock is held.
+        """
+        with open(self.path + ".lock", "a") as lock:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX if block else fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    yield False
+                    return
+            yield True
+
+    def publish(self, version: int, products: list, base: SnapshotView | None = None) -> None:
+        """
+        Build a snapshot and swap it in. Must be called while 'writing'.
+
+        Args:
+            version (int): The catalog version the products were read at.
+            products (list[tuple]): The (id, price_cents, tracked, JSON bytes) of the products, ordered by id.
+            base (SnapshotView, optional): A snapshot the products are appended to, their ids must all be greater.
+                Its records and JSON are copied as they are, so only the new products are rendered.
+        """
+        # The base's sections are written straight from its mapping, only the new products are built in memory
+        base_ids, base_records, base_body = b"", b"", b"["
+        if base is not None:
+            base_ids = base.ids.cast("B")
+            base_records = memoryview(base.mm)[base.records_offset:base.records_offset + RECORD.size * base.count]
+            # The array is copied without its closing bracket, which new products are appended before
+            base_body = base.json[:-1]
+        count = len(base_ids) // 8
+        ids = array("q")
+        records = bytearray()
+        body = bytearray()
+        for product_id, price_cents, tracked, rendered in products:
+            if count:
+                body += b","
+            records += RECORD.pack(product_id, price_cents, len(base_body) + len(body), len(rendered), bool(tracked))
+            body += rendered
+            ids.append(product_id)
+            count += 1
+        body += b"]"
+        fd, temp_path = tempfile.mkstemp(prefix=".catalog-snapshot-", dir=os.path.dirname(os.path.abspath(self.path)))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(HEADER.pack(MAGIC, version, count, len(base_body) + len(body)))
+                for section in (base_ids, ids, base_records, records, base_body, body):
+                    f.write(section)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def discard(self) -> None:
+        """
+        Remove the snapshot file, so readers fall back to the db until it is rebuilt.
+        """
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
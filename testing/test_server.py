@@ -1,21 +1,52 @@
 import pytest
 from src.server import AppFactory
-import os
+from db import Product, Sale, SaleLineItem, seed_db
+import json
+import sqlite3
 
-@pytest.fixture
-def app():
-    basedir = os.path.abspath(os.path.dirname(__file__)) # Store absolute path to current directory
-    test_app = AppFactory(basedir)
+# Pytest fixture to create the app once for the whole session, on a shared in-memory db seeded once.
+# Sales are recorded in durable mode, so every write happens on the test's connection.
+@pytest.fixture(scope="session")
+def shared_app():
+    test_app = AppFactory(database_uri="sqlite://")
+    seed_db(test_app.app)
+    test_app.app.sales_ledger.mode = "durable"
     return test_app
 
+# Pytest fixture wrapping each test in a transaction that is rolled back at the end,
+# so tests share the seeded db without seeing each other's writes
+@pytest.fixture
+def app(shared_app, monkeypatch):
+    with shared_app.app.app_context():
+        engines = shared_app.db.engines
+        connection = shared_app.db.engine.connect()
+    # pysqlite does not emit BEGIN itself before a SAVEPOINT, so the transaction is started explicitly
+    connection.connection.driver_connection.isolation_level = None
+    connection.exec_driver_sql("BEGIN")
+    # Binding every session to the test's connection, where their commits and rollbacks become savepoints
+    monkeypatch.setitem(engines, None, connection)
+    monkeypatch.setitem(shared_app.db.session.session_factory.kw, "join_transaction_mode", "create_savepoint")
+    # Dropping the listings cached by previous tests, whose catalog versions were rolled back
+    shared_app.app.products_service.rendered_catalog = None
+    shared_app.app.compressor.cache.clear()
+    yield shared_app
+    connection.rollback()
+    connection.close()
+
 # Pytest fixture to create and yield a test client
 # This client simulates HTTP requests during tests.
 @pytest.fixture
 def client(app):
     with app.app.test_client() as client:
         yield client
-        app.db.session.remove()
-        app.db.drop_all()
+
+# Pytest fixture to create an app on its own db file, for the tests of its background threads and startup
+@pytest.fixture
+def file_app(tmp_path):
+    test_app = AppFactory(str(tmp_path))
+    seed_db(test_app.app)
+    yield test_app
+    test_app.app.sales_ledger.close()
 
 # Integration test for GET /products endpoint
 def test_get_products(client):
@@ -66,4 +97,542 @@ def test_make_sale(client):
     # The total_sale_price should be the sum of these (discount isn't subtracted from total_sale_price)
     expected_total = 200 + 49.99
     # Use a tolerance for floating point arithmetic
-    assert data["total_sale_price"] - expected_total == 0
\ No newline at end of file
+    assert data["total_sale_price"] - expected_total == 0
+
+# Integration test for POST /sales reporting every unknown product at once
+def test_make_sale_reports_all_missing_products(client):
+    sale_payload = {
+        "line_items": [
+            {"id": 1, "quantity": 1},
+            {"id": 998, "quantity": 1},
+            {"id": 999, "quantity": 1}
+        ],
+        "discount": 0
+    }
+    response = client.post('/sales', json=sale_payload)
+    assert response.status_code == 422
+    assert response.get_json()["error"] == "Products with ids 998, 999 not found."
+
+# Unit test for SalesService.resolve_products, ensuring ids are deduplicated and fetched in chunks
+def test_resolve_products_batches_lookups(app, client, monkeypatch):
+    service = app.app.sales_service
+    monkeypatch.setattr(service, "LOOKUP_CHUNK_SIZE", 2)
+    with app.app.app_context():
+        products = service.resolve_products([1, 2, 1, 3, 2])
+    assert sorted(products) == [1, 2, 3]
+    assert (products[2].name, products[2].price_cents) == ("Copper Kettle", 4999)
+    with app.app.app_context():
+        assert service.product_lookup(2) == {"name": "Copper Kettle", "price": 49.99}
+
+# Integration test for GET /products keyset pagination
+def test_get_products_paginated(client):
+    response = client.get('/products?limit=2')
+    assert response.status_code == 200
+    assert [p["id"] for p in response.get_json()] == [1, 2] # Assuring the first page is ordered by id
+    assert response.headers["Link"] == '</products?after_id=2&limit=2>; rel="next"' # Assuring a full page links to the next one
+
+    response = client.get('/products?after_id=2&limit=2')
+    assert response.status_code == 200
+    assert [p["id"] for p in response.get_json()] == [3]
+    assert "Link" not in response.headers # Assuring the last page has no next link
+
+    response = client.get('/products?limit=abc')
+    assert response.status_code == 422
+    assert client.get('/products?after_id=99999999999999999999999').status_code == 422 # Assuring ids beyond int64 are rejected
+    assert client.get('/products?after_id=99999999999999999999999&stream=json').status_code == 422
+    assert client.get('/products?after_id=9223372036854775807').status_code == 200
+
+# Integration test for GET /products streaming as a JSON array and as NDJSON
+def test_get_products_streamed(client):
+    full = client.get('/products').get_json()
+
+    response = client.get('/products?stream=json')
+    assert response.status_code == 200
+    assert response.get_json() == full # Assuring the streamed array matches the regular listing
+
+    response = client.get('/products?stream=ndjson')
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    lines = response.get_data(as_text=True).splitlines()
+    assert [json.loads(line) for line in lines] == full
+
+# Integration test for GET /products from the db, ensuring a write committed while a listing is read
+# is not served under the ETag of the version read before it
+def test_get_products_etag_matches_body(tmp_path, monkeypatch):
+    monkeypatch.setenv("DB_PROFILE", "production") # WAL, so the other writer commits while the listing is read
+    monkeypatch.setenv("CATALOG_SNAPSHOT", "0")
+    test_app = AppFactory(str(tmp_path))
+    seed_db(test_app.app)
+    client = test_app.app.test_client()
+    service = test_app.app.products_service
+    catalog_version = service.catalog_version
+    def commit_after_version_read():
+        version = catalog_version()
+        other = sqlite3.connect(tmp_path / "catalog.db")
+        with other:
+            other.execute("INSERT INTO product (name, price_cents) VALUES (?, 8000)", (f"Blender {version}",))
+            other.execute("UPDATE catalog_version SET version = version + 1")
+        other.close()
+        return version
+    monkeypatch.setattr(service, "catalog_version", commit_after_version_read)
+    for url in ['/products', '/products?limit=10', '/products?min_price=1']:
+        response = client.get(url)
+        # Assuring the body is the one of the ETag's version, without the product committed after it was read
+        assert f"Blender {response.headers['ETag'].strip(chr(34)).split('-')[0]}" not in [p["name"] for p in response.get_json()]
+    monkeypatch.undo()
+    response = client.get('/products')
+    assert [p["name"] for p in response.get_json()][-3:] == ["Blender 2", "Blender 3", "Blender 4"]
+    test_app.app.sales_ledger.close()
+    with test_app.app.app_context():
+        test_app.db.engine.dispose()
+
+# Integration test for POST /products/bulk with a JSON array, inserted in several chunks
+def test_create_products_bulk(client):
+    mock_data = [{"name": f"Product {i}", "price": 10 + i} for i in range(5)]
+    response = client.post('/products/bulk?chunk_size=2', json=mock_data)
+    assert response.status_code == 201
+    ids = response.get_json()["ids"]
+    assert len(ids) == 5 # Assuring every product was assigned an id
+    products = {p["id"]: p for p in client.get('/products').get_json()}
+    assert [products[i]["name"] for i in ids] == [p["name"] for p in mock_data] # Assuring ids are returned in input order
+
+# Integration test for POST /products/bulk rejecting the whole batch when a record is invalid
+def test_create_products_bulk_reports_errors(client):
+    mock_data = [{"name": "Blender", "price": 80}, {"name": "", "price": 5}, {"name": "Whisk", "price": -1}]
+    response = client.post('/products/bulk', json=mock_data)
+    assert response.status_code == 422
+    assert response.get_json()["errors"] == [
+        {"index": 1, "error": "'name' must not be empty."},
+        {"index": 2, "error": "'price' must be > 0."},
+    ]
+    assert len(client.get('/products').get_json()) == 3 # Assuring nothing was inserted
+
+# Integration test for POST /products/bulk rejecting a JSON body that is not an array
+def test_create_products_bulk_rejects_non_array(client):
+    for body in [5, True, 1.5, "products", {"name": "Blender", "price": 80}]:
+        response = client.post('/products/bulk', json=body)
+        assert response.status_code == 422
+        assert response.get_json()["error"] == "Request must be a JSON array or NDJSON stream of products."
+
+# Integration test for POST /products/bulk with a streamed NDJSON body, committing per chunk
+def test_create_products_bulk_ndjson(client):
+    body = '{"name": "Blender", "price": 80}\n\nnot json\n{"name": "Whisk", "price": 4.5}\n'
+    response = client.post('/products/bulk?commit=chunk', data=body, content_type="application/x-ndjson")
+    assert response.status_code == 201
+    data = response.get_json()
+    assert len(data["ids"]) == 2 # Assuring valid records were inserted
+    assert [e["index"] for e in data["errors"]] == [1] # Assuring the malformed line is reported by index
+
+# Integration test for GET /products ETag revalidation and catalog version bumps on writes
+def test_get_products_etag(client):
+    response = client.get('/products')
+    etag = response.headers["ETag"]
+    assert response.headers["Cache-Control"] # Assuring the listing is cacheable
+
+    response = client.get('/products', headers={"If-None-Match": etag})
+    assert response.status_code == 304 # Assuring an unchanged catalog is not re-sent
+
+    client.post('/products', json={"name": "Microwave", "price": 200})
+    response = client.get('/products', headers={"If-None-Match": etag})
+    assert response.status_code == 200 # Assuring a write invalidates the previous ETag
+    assert response.headers["ETag"] != etag
+    assert len(response.get_json()) == 4
+
+# Unit test for the production engine profile, ensuring its PRAGMAs are applied to every connection
+def test_production_engine_profile(tmp_path, monkeypatch):
+    monkeypatch.setenv("DB_PROFILE", "production")
+    monkeypatch.setenv("SQLITE_BUSY_TIMEOUT", "2500") # Overriding a single PRAGMA of the preset
+    test_app = AppFactory(str(tmp_path))
+    with test_app.app.app_context():
+        with test_app.db.engine.connect() as conn:
+            assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+            assert conn.exec_driver_sql("PRAGMA synchronous").scalar() == 1 # NORMAL
+            assert conn.exec_driver_sql("PRAGMA busy_timeout").scalar() == 2500
+        assert test_app.db.engine.pool.size() == 10
+        test_app.db.engine.dispose()
+
+# Integration test for POST /sales recording the sale through the write-behind ledger
+def test_make_sale_recorded_in_ledger(file_app):
+    app, client = file_app, file_app.app.test_client()
+    assert app.app.sales_ledger.mode == "write-behind"
+    sale_payload = {"line_items": [{"id": 1, "quantity": 2}, {"id": 3, "quantity": 1}], "discount": 4}
+    for _ in range(3):
+        assert client.post('/sales', json=sale_payload).status_code == 200
+    app.app.sales_ledger.flush() # Waiting for the background writer to commit the queued sales
+    with app.app.app_context():
+        sales = app.db.session.scalars(app.db.select(Sale)).all()
+        line_items = app.db.session.scalars(app.db.select(SaleLineItem)).all()
+    assert len(sales) == 3
+    assert all(s.total_sale_price_cents == 22000 and s.discount == 4 for s in sales)
+    assert len(line_items) == 6
+    assert sorted({i.sale_id for i in line_items}) == sorted(s.id for s in sales) # Assuring line items link to their sale
+
+# Integration test for POST /sales in durable ledger mode, where the sale is committed before responding
+def test_make_sale_durable_ledger(app, client):
+    app.app.sales_ledger.mode = "durable"
+    response = client.post('/sales', json={"line_items": [{"id": 2, "quantity": 1}], "discount": 0})
+    assert response.status_code == 200
+    with app.app.app_context():
+        assert app.db.session.scalars(app.db.select(Sale)).one().total_sale_price_cents == 4999
+
+# Integration test for GET /metrics, exposing request, SQL and phase metrics in the Prometheus text format
+def test_metrics(tmp_path, monkeypatch):
+    monkeypatch.setenv("METRICS_PHASE_SAMPLE_RATE", "1") # Timing the phases of every request
+    monkeypatch.setenv("METRICS_SERVER_TIMING", "1")
+    test_app = AppFactory(str(tmp_path))
+    seed_db(test_app.app)
+    client = test_app.app.test_client()
+    response = client.post('/sales', json={"line_items": [{"id": 1, "quantity": 1}], "discount": 0})
+    assert "sales-lookup;dur=" in response.headers["Server-Timing"] # Assuring the phases are reported per response
+    assert 'sql;dur=' in response.headers["Server-Timing"]
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    body = response.get_data(as_text=True)
+    assert 'http_request_duration_seconds_count{method="POST",route="/sales",status="200"} 1' in body
+    assert 'http_request_sql_statements_count{method="POST",route="/sales"} 1' in body
+    assert 'service_phase_duration_seconds_count{phase="sales.lookup"} 1' in body
+    test_app.app.sales_ledger.close()
+
+# Unit test for the pricing engine, ensuring totals and discount splits are exact
+def test_pricing_engine():
+    import pricing
+    assert pricing.split_discount(1000, 3) == [333, 333, 334] # Assuring the shares add up to the discount
+    assert pricing.line_totals([3, 1], [10, 4999]) == ([30, 4999], 5029)
+    assert pricing.from_cents(5029) == 50.29 # Assuring no float drift such as 50.28999
+
+# Integration test for POST /sales with a discount that does not split evenly
+def test_make_sale_uneven_discount(client):
+    sale_payload = {"line_items": [{"id": 2, "quantity": 3}, {"id": 2, "quantity": 1}, {"id": 3, "quantity": 1}], "discount": 10}
+    data = client.post('/sales', json=sale_payload).get_json()
+    assert [item["discount"] for item in data["line_items"]] == [3.33, 3.33, 3.34]
+    assert [item["price"] for item in data["line_items"]] == [149.97, 49.99, 20.0]
+    assert data["total_sale_price"] == 219.96
+
+# Integration test for amounts that would not fit in int64 cents, rejected instead of overflowing the db
+def test_amount_bounds(client):
+    assert client.post('/products', json={"name": "Yacht", "price": 10**17}).status_code == 422
+    assert client.post('/products', json={"name": "Yacht", "price": 100, "stock": 2**63}).status_code == 422
+    assert client.post('/products', json={"name": "Yacht", "price": 1000000}).status_code == 201
+    assert client.post('/sales', json={"line_items": [{"id": 1, "quantity": 2**60}], "discount": 0}).status_code == 422
+    assert client.post('/sales', json={"line_items": [{"id": 1, "quantity": 1}], "discount": 10**17}).status_code == 422
+    assert client.post('/sales', json={"line_items": [{"id": 1, "quantity": 1}], "discount": -10**17}).status_code == 422
+    assert client.post('/sales', json={"line_items": [{"id": 1, "quantity": 1}] * 5001, "discount": 0}).status_code == 422
+    results = client.post('/sales/batch', json=[{"line_items": [{"id": 1, "quantity": 2**60}], "discount": 0}]).get_json()["results"]
+    assert results == [{"error": "A purchase quantity must be at most 10000."}]
+
+# Unit test for the migration of a database created with float dollar prices to integer cents
+def test_migrate_float_prices_to_cents(tmp_path):
+    conn = sqlite3.connect(tmp_path / "catalog.db")
+    conn.execute("CREATE TABLE product (id INTEGER PRIMARY KEY, name VARCHAR(100) NOT NULL, price FLOAT NOT NULL)")
+    conn.executemany("INSERT INTO product VALUES (?, ?, ?)", [(1, "Chrome Toaster", 100.0), (2, "Copper Kettle", 49.99)])
+    conn.commit()
+    conn.close()
+
+    test_app = AppFactory(str(tmp_path))
+    client = test_app.app.test_client()
+    assert client.get('/products').get_json() == [
+        {"id": 1, "name": "Chrome Toaster", "price": 100.0},
+        {"id": 2, "name": "Copper Kettle", "price": 49.99},
+    ]
+    with test_app.app.app_context():
+        assert test_app.db.session.get(Product, 2).price_cents == 4999
+
+# Integration test for POST /sales/batch, with per-sale results and errors returned in order
+def test_make_sales_batch(app, client):
+    batch = [
+        {"line_items": [{"id": 1, "quantity": 2}, {"id": 3, "quantity": 1}], "discount": 4},
+        {"line_items": [{"id": 99, "quantity": 1}], "discount": 0},
+        {"line_items": [], "discount": 0},
+        {"line_items": [{"id": 2, "quantity": 1}], "discount": 0},
+    ]
+    response = client.post('/sales/batch', json=batch)
+    assert response.status_code == 200
+    results = response.get_json()["results"]
+    assert results[0] == client.post('/sales', json=batch[0]).get_json() # Assuring a batch sale matches POST /sales
+    assert results[1] == {"error": "Product with id 99 not found."}
+    assert results[2] == {"error": "Request must include at least one line item."}
+    assert results[3]["total_sale_price"] == 49.99
+    app.app.sales_ledger.flush()
+    with app.app.app_context():
+        assert len(app.db.session.scalars(app.db.select(Sale)).all()) == 3 # The 2 valid batch sales, and the single one
+    assert client.post('/sales/batch', json={"line_items": []}).status_code == 422
+    assert client.post('/sales/batch', json=[]).status_code == 422
+
+# Integration test for the response compression negotiated from Accept-Encoding
+def test_compressed_responses(app, client, monkeypatch):
+    import gzip
+    response = client.get('/products', headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers # Assuring bodies under the minimum size are sent as-is
+    assert response.headers["Vary"] == "Accept-Encoding"
+
+    monkeypatch.setattr(app.app.compressor, "min_size", 0)
+    plain = client.get('/products').get_data()
+    response = client.get('/products', headers={"Accept-Encoding": "br;q=0.5, gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(response.get_data()) == plain
+    etag = response.headers["ETag"]
+    assert etag.startswith('W/') # Assuring the compressed representation gets a weak ETag
+    assert client.get('/products', headers={"Accept-Encoding": "gzip", "If-None-Match": etag}).status_code == 304
+
+    response = client.get('/products?stream=ndjson', headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert [json.loads(line)["id"] for line in gzip.decompress(response.get_data()).splitlines()] == [1, 2, 3]
+
+# Unit test for the JSON providers, ensuring orjson and the stdlib render the same documents
+def test_json_providers(app):
+    from json_provider import load_json_provider, OrjsonProvider
+    from flask.json.provider import DefaultJSONProvider
+    assert load_json_provider({"JSON_PROVIDER": "stdlib"}) is DefaultJSONProvider
+    assert load_json_provider({}) is OrjsonProvider
+    with pytest.raises(ValueError):
+        load_json_provider({"JSON_PROVIDER": "simplejson"})
+    document = {"line_items": [{"price": 49.99, "id": 2}], "total_sale_price": 200, "discount": 0.5}
+    with app.app.app_context():
+        orjson_body = OrjsonProvider(app.app).response(document).get_data()
+        stdlib_body = DefaultJSONProvider(app.app).response(document).get_data()
+    assert orjson_body == stdlib_body
+
+# Integration test for the app startup, skipping the schema setup when the stored schema version is current
+def test_startup_schema_version(tmp_path, monkeypatch):
+    from db import db, SCHEMA_VERSION
+    test_app = AppFactory(str(tmp_path))
+    assert test_app.app.test_client().get('/products').status_code == 404 # Assuring nothing is seeded on startup
+    result = test_app.app.test_cli_runner().invoke(args=["seed"])
+    assert result.output == "Inserted 3 products.\n"
+    assert test_app.app.test_cli_runner().invoke(args=["seed"]).output == "Inserted 0 products.\n"
+    with sqlite3.connect(tmp_path / "catalog.db") as conn:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+
+    def create_all(*args, **kwargs):
+        raise AssertionError("create_all should not run on a current schema")
+    monkeypatch.setattr(db.metadata, "create_all", create_all)
+    test_app = AppFactory(str(tmp_path))
+    assert len(test_app.app.test_client().get('/products').get_json()) == 3
+
+# Unit test for the fork hook, ensuring a forked worker does not reuse its parent's connections
+def test_reset_after_fork(file_app):
+    from server import reset_after_fork
+    with file_app.app.app_context():
+        pool = file_app.db.engine.pool
+        assert pool.checkedin() > 0
+        reset_after_fork(file_app.app)
+        assert file_app.db.engine.pool is not pool
+
+# Integration test for GET /products search and filtering
+def test_search_products(client):
+    assert client.post('/products/bulk', json=[
+        {"name": "Electric Kettle", "price": 35},
+        {"name": "kettle descaler", "price": 7.5},
+        {"name": "Copper Pot", "price": 80},
+    ]).status_code == 201
+    def search(query):
+        response = client.get(f'/products?{query}')
+        assert response.status_code == 200
+        return [p["name"] for p in response.get_json()]
+
+    assert search("name=copper") == ["Copper Kettle", "Copper Pot"] # Assuring the prefix ignores case
+    assert search("q=kettle&max_price=50") == ["Copper Kettle", "Electric Kettle", "kettle descaler"]
+    assert search("q=kettle&sort=-price&limit=2") == ["Copper Kettle", "Electric Kettle"]
+    assert search("q=ket") == ["Copper Kettle", "Electric Kettle", "kettle descaler"] # Assuring the last word matches as a prefix
+    assert search("q=copper+kett") == ["Copper Kettle"]
+    assert search("min_price=20&max_price=49.99&sort=price") == ["Mixing Bowl", "Electric Kettle", "Copper Kettle"]
+    assert search("sort=name&limit=2") == ["Chrome Toaster", "Copper Kettle"]
+    assert search("name=100%25") == [] # Assuring LIKE wildcards in the prefix are matched literally
+    assert search('q="OR"') == []
+
+    assert client.get('/products?q=***').status_code == 422
+    assert client.get('/products?min_price=abc').status_code == 422
+    assert client.get('/products?max_price=100000000000000000000').status_code == 422 # Assuring amounts beyond MAX_PRICE are rejected
+    assert client.get('/products?min_price=99999999999999999999.99').status_code == 422
+    assert client.get('/products?max_price=' + '9' * 400).status_code == 422
+    assert client.get('/products?max_price=1000000').status_code == 200
+    assert client.get('/products?min_price=50&max_price=10').status_code == 422
+    assert client.get('/products?sort=stock').status_code == 422
+    assert client.get('/products?name=kettle&after_id=2').status_code == 422
+
+# Unit test for the search query plans, ensuring searches are served by the indexes
+def test_search_uses_indexes(app):
+    service = app.app.products_service
+    with app.app.app_context():
+        connection = app.db.session.connection()
+        def plan(search):
+            statement = service.search_query(service.validate_search_params(*search, None, None), 10)
+            compiled = statement.compile(connection, compile_kwargs={"literal_binds": True})
+            return " ".join(row[3] for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}"))
+        assert "INDEX ix_product_name" in plan(("kett", None, None, None, "name"))
+        assert "INDEX ix_product_price_cents" in plan((None, None, "10", "50", "price"))
+        assert "product_fts VIRTUAL TABLE INDEX" in plan((None, "kettle", None, None, None))
+
+# Integration test for POST /sales reserving the stock of tracked products, all or nothing
+def test_make_sale_reserves_stock(app, client):
+    product_id = client.post('/products', json={"name": "Toaster", "price": 30, "stock": 3}).get_json()["id"]
+    sale = {"line_items": [{"id": product_id, "quantity": 2}, {"id": 1, "quantity": 1}], "discount": 0}
+    assert client.post('/sales', json=sale).status_code == 200
+    response = client.post('/sales', json=sale)
+    assert response.status_code == 409 # Only 1 toaster is left
+    assert response.get_json() == {
+        "error": "Insufficient stock.",
+        "short": [{"id": product_id, "requested": 2, "available": 1}],
+    }
+    results = client.post('/sales/batch', json=[
+        {"line_items": [{"id": product_id, "quantity": 5}], "discount": 0},
+        {"line_items": [{"id": product_id, "quantity": 1}], "discount": 0},
+    ]).get_json()["results"]
+    assert results[0]["short"] == [{"id": product_id, "requested": 5, "available": 1}]
+    assert results[1]["total_sale_price"] == 30
+    with app.app.app_context():
+        assert app.db.session.get(Product, product_id).stock == 0
+        assert len(app.db.session.scalars(app.db.select(Sale)).all()) == 2 # The rejected sales were not recorded
+    assert client.post('/products', json={"name": "Toaster", "price": 30, "stock": -1}).status_code == 422
+
+# Integration test for concurrent checkouts of a tracked product, ensuring it is never oversold
+def test_concurrent_checkouts_do_not_oversell(tmp_path, monkeypatch):
+    import multiprocessing
+    monkeypatch.setenv("DB_PROFILE", "production")
+    test_app = AppFactory(str(tmp_path))
+    client = test_app.app.test_client()
+    product_id = client.post('/products', json={"name": "Console", "price": 500, "stock": 10}).get_json()["id"]
+    test_app.app.sales_ledger.close()
+    # Each worker process checks out with its own app on the same db file, like the workers of a server
+    with multiprocessing.get_context("spawn").Pool(4) as pool:
+        statuses = sum(pool.starmap(checkout_in_process, [(str(tmp_path), product_id, 10)] * 4), [])
+    assert sorted(set(statuses)) == [200, 409]
+    assert statuses.count(200) == 10
+    with test_app.app.app_context():
+        assert test_app.db.session.get(Product, product_id).stock == 0
+        assert len(test_app.db.session.scalars(test_app.db.select(Sale)).all()) == 10
+        test_app.db.engine.dispose()
+
+# Function run by the worker processes of test_concurrent_checkouts_do_not_oversell
+def checkout_in_process(basedir, product_id, checkouts):
+    worker_app = AppFactory(basedir)
+    sale = {"line_items": [{"id": product_id, "quantity": 1}], "discount": 0}
+    statuses = [worker_app.app.test_client().post('/sales', json=sale).status_code for _ in range(checkouts)]
+    worker_app.app.sales_ledger.close()
+    return statuses
+
+# Integration test for the catalog snapshot shared by the worker processes, ensuring it serves the same
+# responses as the db, picks up the writes of other workers, and falls back to the db without a file
+def test_catalog_snapshot(file_app, tmp_path, monkeypatch):
+    client = file_app.app.test_client()
+    products_service, sales_service = file_app.app.products_service, file_app.app.sales_service
+    snapshot = file_app.app.catalog_snapshot
+    assert snapshot.path == str(tmp_path / "catalog.snapshot")
+    urls = ['/products', '/products?limit=2', '/products?after_id=2&limit=2', '/products?after_id=3']
+    from_snapshot = [client.get(url) for url in urls]
+    monkeypatch.setattr(products_service, "catalog_snapshot", None)
+    from_db = [client.get(url) for url in urls]
+    monkeypatch.undo()
+    for snapshot_response, db_response in zip(from_snapshot, from_db):
+        assert snapshot_response.get_json() == db_response.get_json()
+        assert snapshot_response.headers.get("ETag") == db_response.headers.get("ETag")
+        assert snapshot_response.headers.get("Link") == db_response.headers.get("Link")
+
+    # Another worker, with its own mapping of the snapshot, creates a product
+    worker = AppFactory(str(tmp_path))
+    product_id = worker.app.test_client().post('/products', json={"name": "Blender", "price": 80, "stock": 1}).get_json()["id"]
+    def no_db_lookup(unique_ids):
+        raise AssertionError("products in the snapshot should not be fetched from the db")
+    monkeypatch.setattr(sales_service, "lookup_queries", no_db_lookup)
+    assert client.get('/products').get_json()[-1] == {"id": product_id, "name": "Blender", "price": 80}
+    sale = {"line_items": [{"id": product_id, "quantity": 1}, {"id": 1, "quantity": 1}], "discount": 0}
+    assert client.post('/sales', json=sale).get_json()["total_sale_price"] == 180
+    assert client.post('/sales', json=sale).status_code == 409 # The snapshot knows the stock is tracked
+    with file_app.app.app_context():
+        assert sales_service.product_lookup(product_id) == {"name": "Blender", "price": 80}
+    monkeypatch.undo()
+
+    snapshot.discard()
+    assert client.get('/products').get_json() == from_db[0].get_json() + [{"id": product_id, "name": "Blender", "price": 80}]
+    assert client.post('/sales', json={"line_items": [{"id": 1, "quantity": 1}], "discount": 0}).status_code == 200
+    worker.app.sales_ledger.close()
+
+# Integration test for the catalog snapshot after failed writes, ensuring the committed ones are never hidden
+def test_catalog_snapshot_after_failed_write(file_app, monkeypatch):
+    client = file_app.app.test_client()
+    products_service = file_app.app.products_service
+    etag = client.get('/products').headers["ETag"]
+    insert_products_chunk = products_service.insert_products_chunk
+    def fail_second_chunk(rows, errors, commit):
+        if products_service.db.session.scalar(products_service.db.select(products_service.db.func.count(Product.id))) > 3:
+            raise RuntimeError("db went away")
+        return insert_products_chunk(rows, errors, commit)
+    monkeypatch.setattr(products_service, "insert_products_chunk", fail_second_chunk)
+    records = [{"name": "Lamp", "price": 20}, {"name": "Rug", "price": 90}]
+    assert client.post('/products/bulk?commit=chunk&chunk_size=1', json=records).status_code == 500
+    response = client.get('/products')
+    assert response.headers["ETag"] != etag # Assuring the committed first chunk is not served under the old ETag
+    assert [p["name"] for p in response.get_json()][-1] == "Lamp"
+
+    # A write whose refresh never ran, e.g. in a worker that died right after its commit
+    with file_app.app.app_context():
+        products_service.db.session.add(Product(name="Fan", price_cents=2500))
+        products_service.bump_catalog_version()
+        products_service.db.session.commit()
+    monkeypatch.setattr(products_service, "SNAPSHOT_CHECK_INTERVAL", 0)
+    assert [p["name"] for p in client.get('/products').get_json()][-1] == "Fan"
+
+# Unit test for the catalog snapshot refresh, ensuring a write committed while it reads the catalog
+# is left to the next round rather than published under the version read before it
+def test_catalog_snapshot_matches_version(tmp_path, monkeypatch):
+    monkeypatch.setenv("DB_PROFILE", "production") # WAL, so the other writer commits while the catalog is read
+    test_app = AppFactory(str(tmp_path))
+    seed_db(test_app.app)
+    snapshot, products_service = test_app.app.catalog_snapshot, test_app.app.products_service
+    def commit_product(name):
+        other = sqlite3.connect(tmp_path / "catalog.db")
+        with other:
+            other.execute("INSERT INTO product (name, price_cents) VALUES (?, 8000)", (name,))
+            other.execute("UPDATE catalog_version SET version = version + 1")
+        other.close()
+    commit_product("Blender")
+    version = snapshot.view().version + 1
+    view = snapshot.view
+    def commit_after_version_read():
+        monkeypatch.setattr(snapshot, "view", view)
+        commit_product("Whisk")
+        return view()
+    monkeypatch.setattr(snapshot, "view", commit_after_version_read)
+    published, publish = [], snapshot.publish
+    def record_publish(version, products, base=None):
+        published.append((version, json.loads(products[-1][3])["name"]))
+        publish(version, products, base)
+    monkeypatch.setattr(snapshot, "publish", record_publish)
+    with test_app.app.app_context():
+        products_service.refresh_snapshot()
+        # Whisk is published by the refresh's second round, under its own version
+        assert published == [(version, "Blender"), (version + 1, "Whisk")]
+        assert snapshot.view().version == version + 1
+        test_app.db.engine.dispose()
+    test_app.app.sales_ledger.close()
+
+# Integration test for the coalesced catalog snapshot refreshes, ensuring a write does not wait for the
+# refresh of another worker, and its product is sold and published without it
+def test_catalog_snapshot_coalesces_refreshes(file_app):
+    client = file_app.app.test_client()
+    snapshot = file_app.app.catalog_snapshot
+    version = snapshot.view().version
+    with snapshot.writing(): # Another worker is refreshing the snapshot
+        response = client.post('/products', json={"name": "Blender", "price": 80, "stock": 1})
+        assert response.status_code == 201
+        assert snapshot.view().version == version
+        sale = {"line_items": [{"id": response.get_json()["id"], "quantity": 1}], "discount": 0}
+        assert client.post('/sales', json=sale).get_json()["total_sale_price"] == 80 # Found in the db
+    # The other worker's second round, once it released the lock
+    with file_app.app.app_context():
+        file_app.app.products_service.refresh_snapshot()
+    assert snapshot.view().version == version + 1
+    assert client.get('/products').get_json()[-1] == {"id": response.get_json()["id"], "name": "Blender", "price": 80}
+
+# Unit test for the write-behind ledger, ensuring a sale that cannot be written does not lose the others of its batch
+def test_ledger_retries_failed_batch(file_app, monkeypatch):
+    ledger = file_app.app.sales_ledger
+    monkeypatch.setattr(ledger, "flush_interval", 0.5) # Letting every sale below join the same batch
+    sale = {"line_items": [{"id": 1, "quantity": 1, "price": 100, "discount": 0}], "total_sale_price": 100}
+    unwritable = {**sale, "total_sale_price": 2.0 ** 70} # Its cents overflow the INTEGER column
+    for s in [sale] * 5 + [unwritable] + [sale] * 5:
+        ledger.record(s, 0)
+    ledger.flush()
+    with file_app.app.app_context():
+        assert len(file_app.db.session.scalars(file_app.db.select(Sale)).all()) == 10